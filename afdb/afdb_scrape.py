@@ -19,24 +19,32 @@ license.txt file for more information.
 """
 
 # Imports
-import html
+import os
 import pandas as pd
+import re
 import requests
 import sys
 import time
-from bs4 import BeautifulSoup
+
+# Make the shared pipeline package importable when this script is run directly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline import crawler, listing, profiling
 
 # Constants
-DEBUG = False if len(sys.argv) == 1 else sys.argv[1] == "-debug"
+DEBUG = "-debug" in sys.argv
 DEBUG_NUM_PROJECTS = 5
 
 BASE_URL = 'https://projectsportal.afdb.org/dataportal/VProject/show/'
 CWD = './data/'
 PROJECT_LIST_URL = 'https://projectsportal.afdb.org/dataportal/VProject/exportProjectList?reportName=dataPortal_project_list'
-PROJECT_LIST = CWD + 'afdb_ids_debug.xlsx' if DEBUG else CWD + 'afdb_ids.xlsx'
-OUTPUT_FILE = CWD + 'afdb_data_debug.xlsx' if DEBUG else CWD + 'afdb_data.xlsx'
+PROJECT_LIST = CWD + 'afdb_ids.xlsx'
+DEBUG_PROJECT_LIST = CWD + 'afdb_ids_debug.xlsx'
+OUTPUT_FILE = CWD + 'afdb_data.xlsx'
+DEBUG_OUTPUT_FILE = CWD + 'afdb_data_debug.xlsx'
 SCRAPE_DELAY_IN_SEC = 5
 UA_TO_USD_MULTIPLIER = 1.39589
+# A line break and the whitespace around it (used to join page lines without leading/trailing whitespace)
+LINE_BREAK = re.compile(r'\s*\n\s*')
 # Key = AfDB country name format, Value = IFI project country name format
 IFI_COUNTRIES = { 
     'Angola': 'Angola',
@@ -89,161 +97,145 @@ IFI_COUNTRIES = {
     'Multinational' : 'Multinational'
 }
 
-try:
-    DAC_LOOKUP = pd.read_excel('./DAC-CRS-CODES.xls', sheet_name='Purpose codes', header=2)
-except Exception as e:
-    print("Exception opening DAC code excel file: {0}".format(e))
-    print("This error usually happens when running from the script from the wrong directory. Make sure to run from '411-IFI-Aid/'")
+DAC_CODES_FILE = './DAC-CRS-CODES.xls'
+# Loaded on first use by get_dac_lookup()
+DAC_LOOKUP = None
 
 # Downloads the current list of AfDB projects
-def download_afdb_projects_list():
+def download_afdb_projects_list(project_list=PROJECT_LIST):
     print('Downloading projects spreadsheet from the AfDB website')
     r = requests.get(PROJECT_LIST_URL)
     print('Download complete!')
-    unfiltered_projs = open(PROJECT_LIST, 'wb')
+    unfiltered_projs = open(project_list, 'wb')
     unfiltered_projs.write(r.content)
     unfiltered_projs.close()
-    print('Writing unfiltered projects to ' + PROJECT_LIST)
+    print('Writing unfiltered projects to ' + project_list)
 
-# Download url and return a BeautifulSoup object from the resulting html
-def get_html(url):
-    attempts = 0
-    # Retry up to 20 times, then quit
-    while(attempts < 20):
+# Returns the DAC purpose code table, reading it from the local DAC code spreadsheet the first time
+def get_dac_lookup():
+    global DAC_LOOKUP
+    if DAC_LOOKUP is None:
         try:
-            attempts += 1
-            r = requests.get(url)
-            clean_html = html.unescape(r.text)
-            clean_html = "".join(line.strip() for line in clean_html.split("\n"))
-            return BeautifulSoup(clean_html, 'html.parser')
-        except (Exception) as e:
-            print('Failed to download webpage, trying again')
-            print(e)
-            time.sleep(5)
-    return None
-
-# Find and return data from standard tables on the project page
-def find_in_table(soup, var):
-    try:
-        temp = soup.body.find(text=var).parent.parent.find_next('td').contents[0]
-        return temp
-    except (Exception) as e:
-        return ""
-
-# Find and return data from nonstandard tables on the project page
-def find_in_nonstandard_table(soup, var):
-    try:
-        temp = soup.body.find(text=var).find_parent(class_='col-md-4').find_next(class_='col-md-8').contents[0]
-        return temp
-    except (Exception) as e:
-        return ""
-
-# Find and return data from a project page's heading
-def find_in_heading(soup, title):
-    try: 
-        temp = soup.body.find(text=title).parent.find_next('p').contents[0]
-        return temp
-    except (Exception) as e:
-        return ""
-
-# Returns the description of the given DAC code from the local DAC code spreadsheet
+            DAC_LOOKUP = pd.read_excel(DAC_CODES_FILE, sheet_name='Purpose codes', header=2)
+        except Exception as e:
+            print("Exception opening DAC code excel file: {0}".format(e))
+            print("This error usually happens when running from the script from the wrong directory. Make sure to run from '411-IFI-Aid/'")
+            raise
+    return DAC_LOOKUP
+
+# Returns the description of the given DAC code from the local DAC code spreadsheet, or "N/A" for codes that aren't in it
 def get_dac5_desc(code):
-    if code == None or len(code) < 3 or code == 'N/A':
+    if code == None or len(code) < 3 or not code.strip().isdigit():
         return "N/A"
     code = int(code)
     column_name = 'DAC 5 CODE' if code < 1000 else 'concatenate'
-    desc = DAC_LOOKUP[DAC_LOOKUP[column_name] == code]['DESCRIPTION'].values[0]
-    return desc
-
-# Main
-if not DEBUG:
-    download_afdb_projects_list()
-
-# Read in the unfiltered list of projects
-df = pd.read_excel(PROJECT_LIST)
-print('Filtering to active projects in IFI countries')
-project_ids = df[(df['Status'].isin(['Approved', 'Implementation']) & df['Country'].isin(IFI_COUNTRIES.keys()))]
-
-scraped_data = []
-count = 0
-# Scrape each project and store in scraped_data
-for index, row in project_ids.iterrows():
-    # Drop projects that are not in countries of interest, approved, or in progress
-    if row['Project Code'] == None or row['Project Code'] == '' or (row['Status'] != 'Approved' and row['Status'] != 'Implementation'):
-        next
-
-    # Start timer
-    start_time = time.time()
-    
-    print('\n\nScraping project: {0} (~{1}/{2})'.format(row['Project Code']), count, len(project_ids.index))
-    data = {}
-    soup = get_html(BASE_URL + row['Project Code'])
-
-    # Get details from html
-    data['IFI'] = 'African Development Bank'
-    data['Project ID'] = row['Project Code']
-    country = find_in_table(soup, 'Country')
-    data['Country'] = IFI_COUNTRIES[country.get_text() if type(country) != str else country]
-    # Break down the "Country - Project Title" header to get the title
-    cpt = soup.body.find('h2', class_='title').get_text().split('- ', 1)
-    title = cpt[1] if len(cpt) == 2 else cpt[0]
-    data['Project Title'] = title
-    data['Status'] = find_in_table(soup, 'Status')
-    ua_commitment = find_in_table(soup, 'Commitment').split(' ', 1)[1]
-    data['Commitment Amount (USD)'] = int(float(ua_commitment.replace(',','')) * UA_TO_USD_MULTIPLIER) if ua_commitment != None else None
-    #data['Source of Financing'] = find_in_nonstandard_table(soup, 'Funding').get_text()
-    #data['Sovereign'] = find_in_table(soup, 'Sovereign / Non-Sovereign').get_text()
-    start_date = pd.to_datetime(find_in_table(soup, 'Approval Date'), infer_datetime_format=True)
-    closing_date = pd.to_datetime(find_in_table(soup, 'Planned Completion Date'), infer_datetime_format=True)
-    data['Project Duration'] = round((closing_date - start_date).days / 365.25, 2)
-    data['Approval Date'] = start_date.date().isoformat()
-    data['Closing Date'] = closing_date.date().isoformat()
-    data['Description'] = str(find_in_heading(soup, 'Project General Description')) 
-    obj = str(find_in_heading(soup, 'Project Objectives'))
-    data['Description'] += "\n" + obj if (obj != "" or obj == None) else ""
-    data['Project Contact'] = str(find_in_table(soup, 'Name')).title()
-    data['Contact Details'] = find_in_table(soup, 'Email')
-    data['DAC Sector Code'] = find_in_table(soup, 'DAC Sector Code')
-    data['Detailed Description'] = get_dac5_desc(data['DAC Sector Code'])
-    data['DAC5 Code'] = data['DAC Sector Code'][:3]
-    data['DAC5 Description'] = get_dac5_desc(data['DAC5 Code'])
-    data['Primary Sector'] = find_in_table(soup, 'Sector').get_text()
-    data['Additional Sectors'] = "{0}; {1}".format(data['DAC5 Description'], data['Detailed Description'])
+    dac_lookup = get_dac_lookup()
+    desc = dac_lookup[dac_lookup[column_name] == code]['DESCRIPTION'].values
+    return desc[0] if len(desc) > 0 else "N/A"
+
+# Join page lines, dropping the whitespace around them
+def join_lines(text):
+    return LINE_BREAK.sub('', text).strip()
+
+# Convert a "UA 1,234.56" commitment into USD
+def ua_to_usd(commitment):
+    return int(float(commitment.split(' ', 1)[1].replace(',', '')) * UA_TO_USD_MULTIPLIER)
+
+# Break down the "Country - Project Title" header to get the title
+def title_from_header(header):
+    cpt = header.split('- ', 1)
+    return cpt[1] if len(cpt) == 2 else cpt[0]
+
+def to_date(text):
+    return pd.to_datetime(text, infer_datetime_format=True)
+
+# Fields scraped from each project page (see pipeline/crawler.py)
+FIELDS = [
+    crawler.Field('IFI', crawler.constant('African Development Bank')),
+    crawler.Field('Project ID', crawler.item_id()),
+    crawler.Field('Country', crawler.table('Country'), lambda country: IFI_COUNTRIES[country]),
+    crawler.Field('Project Title', crawler.select('h2.title'), title_from_header),
+    crawler.Field('Status', crawler.table('Status')),
+    crawler.Field('Commitment Amount (USD)', crawler.table('Commitment'), ua_to_usd),
+    #crawler.Field('Source of Financing', crawler.nonstandard_table('Funding')),
+    #crawler.Field('Sovereign', crawler.table('Sovereign / Non-Sovereign')),
+    crawler.Field('Approval Date', crawler.table('Approval Date'), to_date),
+    crawler.Field('Closing Date', crawler.table('Planned Completion Date'), to_date),
+    crawler.Field('Description', crawler.heading('Project General Description')),
+    crawler.Field('Project Objectives', crawler.heading('Project Objectives')),
+    crawler.Field('Project Contact', crawler.table('Name'), str.title),
+    crawler.Field('Contact Details', crawler.table('Email')),
+    crawler.Field('DAC Sector Code', crawler.table('DAC Sector Code')),
+    crawler.Field('Primary Sector', crawler.table('Sector')),
+]
+
+# Derive duration, description and additional sectors from the scraped fields
+def postprocess(data, soup):
+    start_date = data['Approval Date']
+    closing_date = data['Closing Date']
+    data['Project Duration'] = round((closing_date - start_date).days / 365.25, 2) if start_date != None and closing_date != None else None
+    data['Approval Date'] = start_date.date().isoformat() if start_date != None else None
+    data['Closing Date'] = closing_date.date().isoformat() if closing_date != None else None
+    obj = data.pop('Project Objectives')
+    data['Description'] = (data['Description'] or '') + ("\n" + obj if obj else "")
 
     # Remove intermediate DAC sector codes to standardize columns across IFIs
-    data.pop('DAC Sector Code')
-    data.pop('DAC5 Code')
-    data.pop('DAC5 Description')
-    data.pop('Detailed Description')
-
-    # Print and store scraped project
-    if DEBUG:
-        [print(key,':',value) for key, value in data.items()]
-    scraped_data.append(data)
-    
-    # Break if debugging and reached limit
-    count = count + 1
-    if DEBUG and count == DEBUG_NUM_PROJECTS:
-        print("Scraped first {0} projects for debugging, ending now".format(DEBUG_NUM_PROJECTS))
-        break
-
-    # Make sure to wait before scraping each page (10s delay requested by AfDB's robots.txt)
-    elapsed = time.time() - start_time
-    if elapsed < SCRAPE_DELAY_IN_SEC:
-        print("Waiting %.2fs before next scrape" % (SCRAPE_DELAY_IN_SEC - elapsed))
-        time.sleep(SCRAPE_DELAY_IN_SEC - elapsed)
-
-# Convert into an excel file
-print("Creating excel file '%s' with scraped data" % OUTPUT_FILE)
-df = pd.DataFrame.from_records(scraped_data)
-
-# Don't fail because the output file was open
-while True:
-    try:
-        df.to_excel(OUTPUT_FILE, index=False, na_rep='', float_format='%.2f')
-        break
-    except Exception as e:
-        print("Failed to write to Excel file. Please make sure that 1) file is closed, and 2) you are running this script from the 411-IFI-Aid/ folder.")
-        time.sleep(5)
-
-print('All done!')
\ No newline at end of file
+    dac_code = data.pop('DAC Sector Code')
+    data['Additional Sectors'] = "{0}; {1}".format(get_dac5_desc(dac_code[:3] if dac_code else None), get_dac5_desc(dac_code))
+    return data
+
+# Scrape every active AfDB project in an IFI country and return them as a DataFrame
+def scrape(debug=False):
+    project_list = DEBUG_PROJECT_LIST if debug else PROJECT_LIST
+    if not debug and crawler.MODE != 'replay':
+        download_afdb_projects_list(project_list)
+
+    # Read in the active projects in IFI countries from the unfiltered list of projects
+    print('Filtering to active projects in IFI countries')
+    with profiling.stage('afdb_listing'):
+        project_ids = listing.read_listing(project_list, ['Project Code', 'Status', 'Country'],
+            filters={'Status': ['Approved', 'Implementation'], 'Country': list(IFI_COUNTRIES.keys())})
+    project_codes = [code for code in project_ids['Project Code'] if code != None and code != '']
+    if debug:
+        print("Scraping first {0} projects for debugging".format(DEBUG_NUM_PROJECTS))
+        project_codes = project_codes[:DEBUG_NUM_PROJECTS]
+
+    # Make sure to wait between page downloads (10s delay requested by AfDB's robots.txt)
+    afdb_crawler = crawler.Crawler('afdb', BASE_URL + '{0}', FIELDS, clean=join_lines, postprocess=postprocess,
+        workers=2, delay=SCRAPE_DELAY_IN_SEC)
+    with profiling.stage('afdb_crawl'):
+        scraped_data = afdb_crawler.crawl(project_codes)
+
+    # Print scraped projects
+    if debug:
+        for data in scraped_data:
+            [print(key,':',value) for key, value in data.items()]
+
+    return pd.DataFrame.from_records(scraped_data)
+
+# Scrape AfDB projects and write them to the output Excel file
+def main(debug=DEBUG):
+    df = scrape(debug)
+    output_file = DEBUG_OUTPUT_FILE if debug else OUTPUT_FILE
+
+    # Convert into an excel file
+    print("Creating excel file '%s' with scraped data" % output_file)
+
+    # Don't fail because the output file was open
+    while True:
+        try:
+            with profiling.stage('afdb_write'):
+                df.to_excel(output_file, index=False, na_rep='', float_format='%.2f')
+            break
+        except Exception as e:
+            print("Failed to write to Excel file. Please make sure that 1) file is closed, and 2) you are running this script from the 411-IFI-Aid/ folder.")
+            time.sleep(5)
+
+    print('All done!')
+    return df
+
+# Main
+if __name__ == '__main__':
+    crawler.configure_from_args(sys.argv)
+    profiling.enable_from_args(sys.argv)
+    main()
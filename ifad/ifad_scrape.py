@@ -20,22 +20,29 @@ license.txt file for more information.
 
 # Imports
 import csv
-import html
+import os
 import pandas as pd
 import re
-import requests
 import sys
 import time
-import unidecode
-from bs4 import BeautifulSoup
+
+# Make the shared pipeline package importable when this script is run directly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline import crawler, profiling, textclean
 
 # Constants
-DEBUG = False if len(sys.argv) == 1 else sys.argv[1] == "-debug"
+DEBUG = "-debug" in sys.argv
 DEBUG_NUM_PROJECTS = 5
 BASE_URL = 'https://www.ifad.org/en/web/operations/projects-and-programmes?mode=search'
 TABS = [1,2,3]
 PROJECT_URL = 'https://www.ifad.org/en/web/operations/-/project/'
-OUTPUT_FILE = './data/ifad_data_debug.xlsx' if DEBUG else './data/ifad_data.xlsx'
+OUTPUT_FILE = './data/ifad_data.xlsx'
+# Text cleanup steps per column (see pipeline/textclean.py); other text columns are stripped and transliterated
+TEXT_COLUMNS = {
+    # Keep accents in country names
+    'Country': []
+}
+DEBUG_OUTPUT_FILE = './data/ifad_data_debug.xlsx'
 IFI_COUNTRIES = {
     'Angola': 'Angola',
     'Benin': 'Benin',
@@ -87,25 +94,12 @@ IFI_COUNTRIES = {
     'Zimbabwe' : 'Zimbabwe'
 }
 
-def get_html(url):
-    attempts = 0
-    while(attempts < 20):
-        try:
-            attempts += 1
-            response = requests.get(url)
-            clean_html = html.unescape(response.text)
-            return BeautifulSoup(clean_html, 'html.parser')
-        except (Exception) as e:
-            print('Failed to download webpage, trying again')
-            time.sleep(5)
-    return None    
-
 def get_proj_ids(url, tabs):
     """
     This function takes the BASE_URL and TABS to search
     and returns the list of project IDs to scrape
     """
-    soup = get_html(url)
+    soup = crawler.get_html(url)
     projects = list()
     for i in tabs:
         # These are lists of HTML tags. use <element>.text to get to the actual text
@@ -121,74 +115,46 @@ def get_proj_ids(url, tabs):
         projects.extend(relevant_ids)
     return projects
 
-# Manual scraping method that finds param:to_find in param:soup and places its value in param:data
-def manual_scrape(soup, data, to_find, column_name=None):
-    try:
-        ret = soup.find('dt', text=re.compile(r"\s*" + to_find + "\s*")).findNext().text.strip()
-        data[column_name if column_name != None else to_find] = ret
-        return ret
-    except Exception as e:
-        print(e)
-        print('\t{0} not found'.format(to_find))
-
 def rename_indicator(data, old_name, new_name):
     data[new_name] = data.pop(old_name)
 
-# Main
-projects = get_proj_ids(BASE_URL, TABS)
-projects = projects if not DEBUG else projects[:DEBUG_NUM_PROJECTS]
-scraped_data = []
-
-for project_id in projects:
-    data = {}
-    url = PROJECT_URL + project_id
-    print('Scraping {0}'.format(url))
-    soup = get_html(url)
-    if soup == None:
-        next
-    data['IFI'] = "International Fund for Agricultural Development"
-    manual_scrape(soup, data, 'Country')
-    data['Project ID'] = int(project_id)
-    data['Project Title'] = soup.select("h1[class!=\"hide-accessible\"]")[0].text
-    data['Status'] = soup.select('dd.project-status > span')[0].text[8:]
-    manual_scrape(soup, data, 'Approval Date')
-    manual_scrape(soup, data, 'Sector', 'Primary Sector')
-    manual_scrape(soup, data, 'IFAD Financing', 'Commitment Amount (USD)')
-        
-    # Below line takes a number in the form "US$ 52.49 million" and translates it into "52490000"
-    # Assumes that the project funding is in millions (which is not generally safe, but currently works)
-    data['Commitment Amount (USD)'] = int(float(re.findall("[0-9]+\.*[0-9]*", data['Commitment Amount (USD)'])[0]) * 1000000)
-
-    manual_scrape(soup, data, 'Duration', 'Project Duration')
+# Takes a number in the form "US$ 52.49 million" and translates it into "52490000"
+# Assumes that the project funding is in millions (which is not generally safe, but currently works)
+def millions_to_usd(financing):
+    return int(float(re.findall("[0-9]+\.*[0-9]*", financing)[0]) * 1000000)
+
+# Fields scraped from each project page (see pipeline/crawler.py)
+FIELDS = [
+    crawler.Field('IFI', crawler.constant("International Fund for Agricultural Development")),
+    # Translate country names into IFI format (they keep their accents, see TEXT_COLUMNS)
+    crawler.Field('Country', crawler.definition('Country'), lambda country: IFI_COUNTRIES[country]),
+    crawler.Field('Project ID', crawler.item_id(), int),
+    crawler.Field('Project Title', crawler.select("h1[class!=\"hide-accessible\"]")),
+    crawler.Field('Status', crawler.select('dd.project-status > span'), lambda status: status[8:]),
+    crawler.Field('Approval Date', crawler.definition('Approval Date')),
+    crawler.Field('Primary Sector', crawler.definition('Sector')),
+    crawler.Field('Commitment Amount (USD)', crawler.definition('IFAD Financing'), millions_to_usd),
+    crawler.Field('Project Duration', crawler.definition('Duration')),
+    crawler.Field('Project Contact', crawler.definition('Project Contact')),
+    ## Not currently used, but valid scrapes if needed
+    # crawler.Field('Total Project Cost', crawler.definition('Total Project Cost')),
+    # crawler.Field('Financing Gap', crawler.definition('Financing Gap')),
+    # crawler.Field('Financing terms', crawler.definition('Financing terms')),
+]
+
+# Derive duration, closing date and contact details from the scraped fields
+def postprocess(data, soup):
     # Translates duration = "2021 - 2024" into "3"
     duration = re.split(' - ', data['Project Duration'])
     data['Project Duration'] = int(duration[1]) - int(duration[0])
     data['Closing Date'] = int(duration[1])
 
     #Scrape contact data
-    contact_name = manual_scrape(soup, data, 'Project Contact')
+    contact_name = data['Project Contact']
     if contact_name != None and soup.find(text=contact_name) != None:
         data['Contact Details'] = soup.find(text=contact_name).parent['href'][7:]
 
-    for key in data.keys():
-        # Remove special characters, but not from country names
-        if key != 'Country':
-            data[key] = data[key] if type(data[key]) != str else unidecode.unidecode(data[key].strip()).strip()
-        # Translate country names into IFI format
-        else:
-            data[key] = IFI_COUNTRIES[data[key]]
-
-    # Print the scraped data
-    [print('\t{0}: {1}'.format(key, value)) for key, value in data.items()] 
-    print()
-    
-    #Add to list of projects
-    scraped_data.append(data)
-
     ## Not currently used, but valid scrapes if needed
-    # manual_scrape(soup, data, 'Total Project Cost')
-    # manual_scrape(soup, data, 'Financing Gap')
-    # manual_scrape(soup, data, 'Financing terms')
     # # Handle multiple international funders
     # int_funders = ''
     # f = soup.find(text='Co-financiers (International)')
@@ -211,18 +177,54 @@ for project_id in projects:
     # if len(dom_funders) > 0:
     #     data['Co-financiers (Domestic)'] = dom_funders
 
-# Export into excel file
-print("Creating excel file '{0}' with scraped data".format(OUTPUT_FILE))
-df = pd.DataFrame.from_records(scraped_data)
-
-# Don't fail because the output file was open
-while True:
-    try:
-        df.to_excel(OUTPUT_FILE, index=False, na_rep='', float_format='%.2f')
-        break
-    except Exception as e:
-        print(e)
-        print("Failed to write to Excel file. Please make sure that 1) file is closed, and 2) you are running this script from the 411-IFI-Aid/ folder.")
-        time.sleep(5)
-
-print('All done!')
\ No newline at end of file
+    return data
+
+# Scrape every IFAD project in an IFI country and return them as a DataFrame
+def scrape(debug=False):
+    with profiling.stage('ifad_listing'):
+        projects = get_proj_ids(BASE_URL, TABS)
+    projects = projects if not debug else projects[:DEBUG_NUM_PROJECTS]
+
+    # Clean up text on a process pool while the remaining pages download
+    ifad_crawler = crawler.Crawler('ifad', PROJECT_URL + '{0}', FIELDS, postprocess=postprocess)
+    with profiling.stage('ifad_crawl'), textclean.BulkNormalizer(TEXT_COLUMNS) as normalizer:
+        for batch in ifad_crawler.crawl_batches(projects):
+            for data in batch:
+                # Print the scraped data
+                if debug:
+                    [print('\t{0}: {1}'.format(key, value)) for key, value in data.items()] 
+                    print()
+
+                #Add to list of projects
+                normalizer.submit(data)
+        scraped_data = normalizer.results()
+
+    return pd.DataFrame.from_records(scraped_data)
+
+# Scrape IFAD projects and write them to the output Excel file
+def main(debug=DEBUG):
+    df = scrape(debug)
+    output_file = DEBUG_OUTPUT_FILE if debug else OUTPUT_FILE
+
+    # Export into excel file
+    print("Creating excel file '{0}' with scraped data".format(output_file))
+
+    # Don't fail because the output file was open
+    while True:
+        try:
+            with profiling.stage('ifad_write'):
+                df.to_excel(output_file, index=False, na_rep='', float_format='%.2f')
+            break
+        except Exception as e:
+            print(e)
+            print("Failed to write to Excel file. Please make sure that 1) file is closed, and 2) you are running this script from the 411-IFI-Aid/ folder.")
+            time.sleep(5)
+
+    print('All done!')
+    return df
+
+# Main
+if __name__ == '__main__':
+    crawler.configure_from_args(sys.argv)
+    profiling.enable_from_args(sys.argv)
+    main()
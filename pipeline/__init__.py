@@ -0,0 +1,9 @@
+""" Shared pipeline stages used by run_all.py and the IFI scrapers
+"""
+__copyright__ = """
+Copyright 2021 Evans Policy Analysis and Research Group (EPAR).
+"""
+__license__ = """
+This project is licensed under the 3-Clause BSD License. Please see the 
+license.txt file for more information.
+"""
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+""" Shared fetch/parse engine for the IFI project page scrapers
+
+Each scraper describes the data it wants as a list of Fields (column name, lookup, optional converter)
+and hands it to a Crawler, which downloads pages concurrently with retries, rate limiting, batching and an
+optional page cache, and parses and extracts them on the calling thread (so profiling can see the parse cost). Adding a new IFI only needs a new list of Fields.
+"""
+__copyright__ = """
+Copyright 2021 Evans Policy Analysis and Research Group (EPAR).
+"""
+__license__ = """
+This project is licensed under the 3-Clause BSD License. Please see the
+license.txt file for more information.
+"""
+# Imports
+import collections
+import concurrent.futures
+import hashlib
+import html
+import json
+import os
+import re
+import threading
+import time
+import requests
+from bs4 import BeautifulSoup
+from pipeline import profiling
+
+# Constants
+RETRIES = 20
+RETRY_DELAY_IN_SEC = 5
+TIMEOUT_IN_SEC = 60
+BATCH_SIZE = 20
+PAGE_CACHE_DIR = './data/cache/pages/'
+# 'live' downloads every page, 'record' also saves them to PAGE_CACHE_DIR, and 'replay' only reads saved pages (no network)
+MODES = ['live', 'record', 'replay']
+MODE = 'live'
+
+# A column of scraped data: lookup(page, item_id) finds the raw value and convert (if given) cleans it up.
+# Converters only run on values that were found; missing values are stored as None.
+Field = collections.namedtuple('Field', ['name', 'lookup', 'convert'], defaults=[None])
+
+# Set the page cache mode for every crawler (see MODES)
+def configure(mode):
+    global MODE
+    if mode not in MODES:
+        raise ValueError('Unknown page cache mode {0}, expected one of {1}'.format(mode, MODES))
+    MODE = mode
+
+# Set the page cache mode from "-record" or "-replay" on a scraper's command line
+def configure_from_args(argv):
+    for mode in MODES:
+        if '-' + mode in argv:
+            configure(mode)
+
+def cache_path(url, cache_dir=PAGE_CACHE_DIR):
+    return os.path.join(cache_dir, hashlib.sha1(url.encode()).hexdigest() + '.txt')
+
+# Download url (retrying on errors) and return its text, reading and writing the page cache depending on MODE
+def fetch(url, retries=RETRIES, cache_dir=PAGE_CACHE_DIR):
+    path = cache_path(url, cache_dir)
+    if MODE == 'replay':
+        with open(path, encoding='utf-8') as f:
+            return f.read()
+    attempts = 0
+    while True:
+        try:
+            attempts += 1
+            response = requests.get(url, timeout=TIMEOUT_IN_SEC)
+            # Server errors are usually temporary, anything else is returned as is
+            if response.status_code < 500:
+                break
+            response.raise_for_status()
+        except (Exception) as e:
+            if attempts >= retries:
+                raise
+            print('Failed to download {0}, trying again ({1})'.format(url, e))
+            time.sleep(RETRY_DELAY_IN_SEC)
+    if MODE == 'record':
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(response.text)
+    return response.text
+
+# Parse a downloaded page as html, optionally cleaning the unescaped text first
+def parse_html(text, clean=None):
+    text = html.unescape(text)
+    return BeautifulSoup(clean(text) if clean != None else text, 'html.parser')
+
+# Parse a downloaded JSON document, unescaping html entities (e.g. &#39; in names) in its string values
+def parse_json(text):
+    return unescape_values(json.loads(text))
+
+def unescape_values(value):
+    if isinstance(value, str):
+        return html.unescape(value)
+    if isinstance(value, dict):
+        return {key: unescape_values(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [unescape_values(item) for item in value]
+    return value
+
+# Download url and return a BeautifulSoup object from the resulting html
+def get_html(url, clean=None):
+    return parse_html(fetch(url), clean)
+
+# Text of a BeautifulSoup element or string
+def text_of(element):
+    return element.get_text() if hasattr(element, 'get_text') else str(element)
+
+# Lookups. Each returns a function that takes a parsed page and the item's ID, and returns the raw value or None.
+
+def constant(value):
+    return lambda page, item_id: value
+
+def item_id():
+    return lambda page, item_id: item_id
+
+# Value cell next to a label in a standard <table>
+def table(label):
+    def lookup(page, item_id):
+        return text_of(page.body.find(text=label).parent.parent.find_next('td').contents[0])
+    return lookup
+
+# Value next to a label in a nonstandard, bootstrap-column table
+def nonstandard_table(label):
+    def lookup(page, item_id):
+        return text_of(page.body.find(text=label).find_parent(class_='col-md-4').find_next(class_='col-md-8').contents[0])
+    return lookup
+
+# First paragraph after a heading
+def heading(title):
+    def lookup(page, item_id):
+        return text_of(page.body.find(text=title).parent.find_next('p').contents[0])
+    return lookup
+
+# Definition (<dd>) that follows a term (<dt>)
+def definition(term):
+    pattern = re.compile(r"\s*" + term + r"\s*")
+    def lookup(page, item_id):
+        return page.find('dt', text=pattern).findNext().text.strip()
+    return lookup
+
+# Text of the first element matching a CSS selector
+def select(selector):
+    def lookup(page, item_id):
+        return page.select(selector)[0].text
+    return lookup
+
+# Value inside a parsed JSON document. A key of None is replaced by the item's ID.
+def json_path(*keys):
+    def lookup(page, item_id):
+        for key in keys:
+            page = page[item_id if key is None else key]
+        return page
+    return lookup
+
+# Crawls pages for a list of item IDs and extracts one record per page.
+# url is a format string for the item ID, parser is 'html' or 'json', clean optionally rewrites html before parsing,
+# and postprocess(record, page) can add or combine fields after extraction. workers sets the number of concurrent
+# downloads and delay the minimum number of seconds between starting downloads (for sites that ask for a crawl delay).
+class Crawler:
+    def __init__(self, name, url, fields, parser='html', clean=None, postprocess=None, workers=4, delay=0,
+            retries=RETRIES, batch_size=BATCH_SIZE):
+        self.name = name
+        self.url = url
+        self.fields = fields
+        self.parser = parser
+        self.clean = clean
+        self.postprocess = postprocess
+        self.workers = workers
+        self.delay = delay
+        self.retries = retries
+        self.batch_size = batch_size
+        self.cache_dir = os.path.join(PAGE_CACHE_DIR, name)
+        self.lock = threading.Lock()
+        self.next_request = 0
+
+    # Wait until the crawl delay since the previous download has passed
+    def wait_turn(self):
+        if self.delay <= 0 or MODE == 'replay':
+            return
+        with self.lock:
+            wait = self.next_request - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            self.next_request = time.time() + self.delay
+
+    def parse(self, text):
+        return parse_json(text) if self.parser == 'json' else parse_html(text, self.clean)
+
+    # Missing fields are stored as None and listed in one message per item, so layout changes on a site don't go unnoticed
+    def extract(self, page, item):
+        record = {}
+        missing = []
+        for field in self.fields:
+            try:
+                value = field.lookup(page, item)
+            except (Exception) as e:
+                value = None
+                missing.append(field.name)
+            record[field.name] = field.convert(value) if field.convert != None and value != None else value
+        if len(missing) > 0:
+            print('\t{0} {1}: {2} not found'.format(self.name, item, ', '.join(missing)))
+        if self.postprocess != None:
+            record = self.postprocess(record, page)
+        return record
+
+    # Download a single item's page. Returns None (and prints the error) if the download fails.
+    def download(self, item):
+        try:
+            self.wait_turn()
+            return fetch(self.url.format(item), self.retries, self.cache_dir)
+        except (Exception) as e:
+            print('Failed to scrape {0} {1}: {2!r}'.format(self.name, item, e))
+            return None
+
+    # Parse and extract a downloaded page. Returns None (and prints the error) if either step fails.
+    def process(self, item, text):
+        try:
+            return self.extract(self.parse(text), item)
+        except (Exception) as e:
+            print('Failed to scrape {0} {1}: {2!r}'.format(self.name, item, e))
+            return None
+
+    # Download, parse and extract a single item, or None if any step fails
+    def scrape(self, item):
+        text = self.download(item)
+        return self.process(item, text) if text != None else None
+
+    # Yields lists of records, one batch of items at a time. Items that failed to scrape are left out.
+    # The next batch is downloading while the current one is parsed.
+    def crawl_batches(self, items):
+        items = list(items)
+        batches = [items[start:start + self.batch_size] for start in range(0, len(items), self.batch_size)]
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+            submit = lambda batch: [pool.submit(self.download, item) for item in batch]
+            downloads = submit(batches[0]) if len(batches) > 0 else []
+            for i, batch in enumerate(batches):
+                texts = [future.result() for future in downloads]
+                downloads = submit(batches[i + 1]) if i + 1 < len(batches) else []
+                start = i * self.batch_size
+                print('Scraping {0} {1}-{2} of {3}'.format(self.name, start + 1, start + len(batch), len(items)))
+                with profiling.stage(self.name + '_parse'):
+                    records = [self.process(item, text) for item, text in zip(batch, texts) if text != None]
+                yield [record for record in records if record != None]
+
+    # Scrape every item and return the list of records
+    def crawl(self, items):
+        return [record for batch in self.crawl_batches(items) for record in batch]
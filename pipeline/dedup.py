@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+""" Link co-financed projects that appear under more than one IFI
+"""
+__copyright__ = """
+Copyright 2021 Evans Policy Analysis and Research Group (EPAR).
+"""
+__license__ = """
+This project is licensed under the 3-Clause BSD License. Please see the
+license.txt file for more information.
+"""
+# Imports
+import collections
+import math
+import re
+import sys
+import numpy as np
+import pandas as pd
+import unidecode
+
+# Constants
+# Minimum cosine similarity between TF-IDF title vectors for two projects to be linked
+SIMILARITY_THRESHOLD = 0.6
+SHINGLE_SIZE = 3
+CLUSTER_COLUMN = 'Cluster ID'
+NON_ALPHANUMERIC = re.compile(r'[^a-z0-9]+')
+YEAR = r'((?:19|20)\d{2})'
+
+# Lowercase, transliterate and strip punctuation so small formatting differences don't matter
+def clean_title(title):
+    return NON_ALPHANUMERIC.sub(' ', unidecode.unidecode(str(title)).lower()).strip()
+
+# Character n-grams of each word, padded with spaces so word boundaries count
+def shingles(title):
+    grams = collections.Counter()
+    for word in title.split():
+        word = ' ' + word + ' '
+        grams.update(word[i:i + SHINGLE_SIZE] for i in range(max(len(word) - SHINGLE_SIZE + 1, 1)))
+    return grams
+
+# Find the root of a union-find tree, compressing the path on the way
+def find(parents, i):
+    root = i
+    while parents[root] != root:
+        root = parents[root]
+    while parents[i] != root:
+        parents[i], i = root, parents[i]
+    return root
+
+# Join the trees of rows a and b unless that would put two projects from the same IFI in one cluster
+# (e.g. phases I and II of a WB project that both match one AfDB listing). ifis holds the IFIs in each tree, keyed on its root.
+def union(parents, ifis, a, b):
+    a, b = find(parents, a), find(parents, b)
+    if a == b or len(ifis[a] & ifis[b]) > 0:
+        return
+    parents[a] = b
+    ifis[b] |= ifis.pop(a)
+
+# Return a cluster ID for every row of df; rows that share an ID are the same co-financed project.
+# Candidates are blocked by country and approval year, so only projects within the same block are compared.
+# Each cluster has at most one project per IFI, and the most similar pairs are linked first.
+def cluster_ids(df, threshold=SIMILARITY_THRESHOLD):
+    n = len(df.index)
+    titles = df['Project Title'].fillna('').map(clean_title)
+    grams = [shingles(t) for t in titles]
+    doc_freq = collections.Counter(g for doc in grams for g in doc)
+    idf = {g: math.log((1 + n) / (1 + f)) + 1 for g, f in doc_freq.items()}
+
+    years = df['Approval Date'].astype(str).str.extract(YEAR, expand=False)
+    blocks = pd.DataFrame({'country': df['Country'].values, 'year': years.values, 'ifi': pd.factorize(df['IFI'])[0]})
+    parents = list(range(n))
+    cluster_ifis = {i: {ifi} for i, ifi in enumerate(blocks['ifi'])}
+    for _, block in blocks.groupby(['country', 'year'], sort=False):
+        # Co-financing only matters across institutions
+        if len(block.index) < 2 or block['ifi'].nunique() < 2:
+            continue
+        rows = block.index.values
+        vocab = {}
+        for i in rows:
+            for g in grams[i]:
+                vocab.setdefault(g, len(vocab))
+        vectors = np.zeros((len(rows), max(len(vocab), 1)))
+        for r, i in enumerate(rows):
+            for g, count in grams[i].items():
+                vectors[r, vocab[g]] = count * idf[g]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+        similarity = vectors @ vectors.T
+        ifis = block['ifi'].to_numpy()
+        similar = (similarity >= threshold) & (ifis[:, None] != ifis[None, :])
+        pairs = np.transpose(np.nonzero(np.triu(similar, k=1)))
+        for a, b in pairs[np.argsort(-similarity[pairs[:, 0], pairs[:, 1]], kind='stable')]:
+            union(parents, cluster_ifis, rows[a], rows[b])
+
+    roots = [find(parents, i) for i in range(n)]
+    return pd.Series(pd.factorize(pd.Series(roots))[0] + 1, index=df.index, name=CLUSTER_COLUMN)
+
+# Main
+if __name__ == '__main__':
+    # Usage: python pipeline/dedup.py [merged data file]
+    input_file = sys.argv[1] if len(sys.argv) > 1 else './data/ifi_data.xlsx'
+    df = pd.read_excel(input_file)
+    df[CLUSTER_COLUMN] = cluster_ids(df)
+    linked = df[df.duplicated(CLUSTER_COLUMN, keep=False)].sort_values(CLUSTER_COLUMN)
+    print('Found {0} projects listed under more than one IFI'.format(linked[CLUSTER_COLUMN].nunique()))
+    print(linked[[CLUSTER_COLUMN, 'IFI', 'Country', 'Approval Date', 'Project Title']].to_string(index=False))
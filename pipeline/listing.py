@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+""" Read the IFIs' bulk project-list spreadsheets, keeping only the columns and rows we need
+
+.xlsx files are streamed row by row. xlrd can't stream legacy .xls files: it parses the whole sheet into
+memory, so for those the savings come from building DataFrames only for the wanted columns and rows, and
+from the parquet cache, which skips parsing entirely until the file changes.
+"""
+__copyright__ = """
+Copyright 2021 Evans Policy Analysis and Research Group (EPAR).
+"""
+__license__ = """
+This project is licensed under the 3-Clause BSD License. Please see the
+license.txt file for more information.
+"""
+# Imports
+import hashlib
+import os
+import openpyxl
+import pandas as pd
+import xlrd
+
+# Constants
+CACHE_DIR = './data/cache/'
+CHUNK_SIZE = 5000
+HASH_BLOCK_SIZE = 1 << 20
+XLS_MAGIC = b'\xd0\xcf\x11\xe0'
+XLSX_MAGIC = b'PK'
+
+# sha256 of a file, read in blocks so large downloads aren't loaded into memory
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Yields the header, then lists of rows, from a legacy .xls file. xlrd parses every cell of the sheet when it is loaded,
+# so this only avoids converting unwanted columns and building a DataFrame for the whole sheet.
+def xls_chunks(path, header, columns, chunk_size):
+    book = xlrd.open_workbook(path, on_demand=True, use_mmap=True)
+    try:
+        sheet = book.sheet_by_index(0)
+        names = [str(name) for name in sheet.row_values(header)]
+        indices = [i for i, name in enumerate(names) if columns(name)]
+        yield [names[i] for i in indices]
+        for start in range(header + 1, sheet.nrows, chunk_size):
+            end = min(start + chunk_size, sheet.nrows)
+            values = []
+            for i in indices:
+                col = sheet.col_values(i, start, end)
+                types = sheet.col_types(i, start, end)
+                values.append([None if t in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK)
+                    else xlrd.xldate_as_datetime(v, book.datemode) if t == xlrd.XL_CELL_DATE else v
+                    for v, t in zip(col, types)])
+            yield list(zip(*values))
+    finally:
+        book.release_resources()
+
+# Yields the header, then lists of rows, from an .xlsx file using openpyxl's streaming (read-only) mode
+def xlsx_chunks(path, header, columns, chunk_size):
+    book = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = book.worksheets[0].iter_rows(min_row=header + 1, values_only=True)
+        names = [str(name) for name in next(rows)]
+        indices = [i for i, name in enumerate(names) if columns(name)]
+        yield [names[i] for i in indices]
+        chunk = []
+        for row in rows:
+            chunk.append(tuple(row[i] if i < len(row) else None for i in indices))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if len(chunk) > 0:
+            yield chunk
+    finally:
+        book.close()
+
+# Convert columns that mix text with other values (e.g. numeric and text project IDs) to text so the result can be
+# stored as parquet and hashed consistently. Other columns keep their types. Also used for snapshots (see pipeline/snapshot.py).
+def normalize(df):
+    for col in df.columns:
+        if df[col].dtype == object:
+            is_text = df[col].dropna().map(lambda value: isinstance(value, str))
+            if is_text.any() and not is_text.all():
+                df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+# Read a project-list spreadsheet, keeping only the usecols columns (all columns if None) and the rows whose
+# filter columns have one of the allowed values. filters maps column names to allowed values.
+# The result is cached as parquet, keyed on the file's hash and the requested columns and filters.
+def read_listing(path, usecols=None, filters={}, header=0, chunk_size=CHUNK_SIZE, cache_dir=CACHE_DIR):
+    columns = lambda name: usecols is None or name in usecols or name in filters
+
+    key = repr((file_hash(path), header, sorted(usecols) if usecols is not None else None,
+        sorted((col, sorted(map(str, allowed))) for col, allowed in filters.items())))
+    cached = os.path.join(cache_dir, '{0}_{1}.parquet'.format(os.path.splitext(os.path.basename(path))[0],
+        hashlib.sha256(key.encode()).hexdigest()[:16]))
+    if os.path.exists(cached):
+        return pd.read_parquet(cached)
+
+    with open(path, 'rb') as f:
+        magic = f.read(len(XLS_MAGIC))
+    if magic.startswith(XLS_MAGIC):
+        chunks = xls_chunks(path, header, columns, chunk_size)
+    elif magic.startswith(XLSX_MAGIC):
+        chunks = xlsx_chunks(path, header, columns, chunk_size)
+    else:
+        # Not a real spreadsheet (e.g. an HTML table saved as .xls), let pandas work it out
+        chunks = None
+
+    if chunks is not None:
+        names = next(chunks)
+        kept = []
+        # Filter each chunk as it is read so only the matching rows are kept (.xlsx files are never fully loaded)
+        for chunk in chunks:
+            df = pd.DataFrame.from_records(chunk, columns=names)
+            for col, allowed in filters.items():
+                df = df[df[col].isin(allowed)]
+            kept.append(df)
+        # A chunk whose column is all blank is read as objects, so work out the column types again after combining the chunks
+        df = pd.concat(kept, ignore_index=True).infer_objects() if len(kept) > 0 else pd.DataFrame(columns=names)
+    else:
+        df = pd.read_excel(path, header=header, usecols=columns)
+        for col, allowed in filters.items():
+            df = df[df[col].isin(allowed)]
+        df = df.reset_index(drop=True)
+    df = normalize(df)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        df.to_parquet(cached, index=False)
+    except Exception as e:
+        print("Couldn't cache {0} as parquet: {1}".format(path, e))
+    return df
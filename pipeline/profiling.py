@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+""" Opt-in cProfile and tracemalloc reports for each pipeline stage
+
+Wrap a stage in "with profiling.stage('name'):". Nothing is measured unless profiling was enabled
+(run_all.py --profile, or -profile on a scraper's command line). When enabled, each stage writes
+<name>.pstats (open with "python -m pstats") and <name>_memory.txt (time, peak memory and top allocations)
+to PROFILE_DIR when the program exits. A stage's pstats exclude time spent in stages nested inside it,
+while its total time and memory include them. Repeated stages with the same name (e.g. one per crawl batch)
+are added together; their top allocations are taken from the first run only, to keep the per-run cost low.
+"""
+__copyright__ = """
+Copyright 2021 Evans Policy Analysis and Research Group (EPAR).
+"""
+__license__ = """
+This project is licensed under the 3-Clause BSD License. Please see the
+license.txt file for more information.
+"""
+# Imports
+import atexit
+import contextlib
+import cProfile
+import os
+import time
+import tracemalloc
+
+# Constants
+PROFILE_DIR = './data/profiles/'
+TOP_ALLOCATIONS = 25
+MIB = 1024 * 1024
+ENABLED = False
+
+# Profilers, total seconds, peak memory, number of runs and top allocations of every stage so far (keyed on stage name)
+profilers = {}
+totals = {}
+peaks = {}
+runs = {}
+allocations = {}
+# Stages currently running, innermost last, with their peak memory and profiling overhead so far
+running = []
+
+# Turn on profiling for every stage from now on
+def enable(profile_dir=PROFILE_DIR):
+    global ENABLED, PROFILE_DIR
+    ENABLED = True
+    PROFILE_DIR = profile_dir
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        atexit.register(finish)
+
+# Turn on profiling if "-profile" is on a script's command line
+def enable_from_args(argv):
+    if '-profile' in argv:
+        enable()
+
+# Peak traced memory since the last reset
+def current_peak():
+    return tracemalloc.get_traced_memory()[1]
+
+# Largest allocations made between two snapshots, leaving out the profilers' own bookkeeping
+def top_allocations(before, after):
+    ignore = [tracemalloc.Filter(False, cProfile.__file__), tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    return [str(stat) for stat in after.filter_traces(ignore).compare_to(before.filter_traces(ignore), 'lineno')[:TOP_ALLOCATIONS]]
+
+def write_reports(name):
+    profilers[name].dump_stats(os.path.join(PROFILE_DIR, name + '.pstats'))
+    with open(os.path.join(PROFILE_DIR, name + '_memory.txt'), 'w') as f:
+        f.write('Stage: {0}\n'.format(name))
+        f.write('Total time: {0:.2f}s over {1} run(s)\n'.format(totals[name], runs[name]))
+        f.write('Peak traced memory: {0:.1f} MiB\n'.format(peaks[name] / MIB))
+        f.write('\nTop {0} allocations made during the first run of this stage:\n'.format(TOP_ALLOCATIONS))
+        for stat in allocations.get(name, []):
+            f.write(stat + '\n')
+
+# Write every stage's reports and print their total time and peak memory
+def finish():
+    if len(totals) == 0:
+        return
+    print('\nProfiled stages (reports in {0}):'.format(PROFILE_DIR))
+    for name in totals:
+        write_reports(name)
+        print('  {0}: {1:.2f}s over {2} run(s), peak {3:.1f} MiB'.format(name, totals[name], runs[name], peaks[name] / MIB))
+
+# Leave time spent on profiling bookkeeping out of the totals of every running stage
+def add_overhead(seconds):
+    for entry in running:
+        entry['overhead'] += seconds
+
+# Profile the code inside the with block as the named stage (does nothing unless profiling is enabled)
+@contextlib.contextmanager
+def stage(name):
+    if not ENABLED:
+        yield
+        return
+
+    paused = time.perf_counter()
+    # Pause the enclosing stage so its profile only covers its own work
+    if len(running) > 0:
+        outer = running[-1]
+        profilers[outer['name']].disable()
+        outer['peak'] = max(outer['peak'], current_peak())
+
+    profiler = profilers.setdefault(name, cProfile.Profile())
+    totals.setdefault(name, 0)
+    peaks.setdefault(name, 0)
+    runs.setdefault(name, 0)
+    first_run = name not in allocations
+    before = tracemalloc.take_snapshot() if first_run else None
+    # Measure this stage's peak from here, leaving out the snapshot above
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    add_overhead(start - paused)
+    current = {'name': name, 'peak': 0, 'overhead': 0}
+    running.append(current)
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        end = time.perf_counter()
+        running.pop()
+        totals[name] += end - start - current['overhead']
+        runs[name] += 1
+        current['peak'] = max(current['peak'], current_peak())
+        peaks[name] = max(peaks[name], current['peak'])
+        if first_run:
+            allocations[name] = top_allocations(before, tracemalloc.take_snapshot())
+            before = None
+            print('Profiled {0}: {1:.2f}s, peak {2:.1f} MiB (reports are written to {3} on exit)'.format(name, totals[name], peaks[name] / MIB, PROFILE_DIR))
+
+        # Resume the enclosing stage, counting this stage's memory towards it but not the bookkeeping above
+        tracemalloc.reset_peak()
+        if len(running) > 0:
+            outer = running[-1]
+            outer['peak'] = max(outer['peak'], current['peak'])
+        add_overhead(time.perf_counter() - end)
+        if len(running) > 0:
+            profilers[outer['name']].enable()
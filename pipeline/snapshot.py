@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+""" Snapshot the merged IFI data and report changes between consecutive runs
+"""
+__copyright__ = """
+Copyright 2021 Evans Policy Analysis and Research Group (EPAR).
+"""
+__license__ = """
+This project is licensed under the 3-Clause BSD License. Please see the
+license.txt file for more information.
+"""
+# Imports
+import datetime
+import glob
+import os
+import sys
+import pandas as pd
+# Make the shared pipeline package importable when this script is run directly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline import listing
+
+# Constants
+SNAPSHOT_DIR = './data/snapshots/'
+SNAPSHOT_PREFIX = 'ifi_data_'
+CHANGES_FILE = './data/ifi_changes.xlsx'
+KEY_COLUMNS = ['IFI', 'Project ID']
+# Added to the key when a project has one row per country (WB multi-region projects split with EXPLODE_MULTI_REGION)
+ALLOCATION_COLUMN = 'Country'
+COMMITMENT_COLUMN = 'Commitment Amount (USD)'
+# Columns that are regenerated on every run and shouldn't count as a change
+IGNORE_COLUMNS = ['#', 'Cluster ID']
+# Statuses that mean a project has finished (projects that disappear from a snapshot are also counted as closed)
+CLOSED_STATUSES = ['Closed', 'Completed', 'Dropped', 'Cancelled', 'Terminated']
+CHANGE_COLUMNS = KEY_COLUMNS + ['Country', 'Project Title', 'Change', 'Changed Fields',
+    'Previous Commitment (USD)', COMMITMENT_COLUMN, 'Commitment Change (USD)']
+
+# Drop the regenerated columns and make mixed-type columns (e.g. int and str project IDs) consistent so they can be stored in parquet and hashed
+def normalize(df):
+    return listing.normalize(df.drop(columns=[c for c in IGNORE_COLUMNS if c in df.columns]))
+
+# Write the merged data as a columnar snapshot named after the run date and return its path
+def save_snapshot(df, date=None, snapshot_dir=SNAPSHOT_DIR):
+    os.makedirs(snapshot_dir, exist_ok=True)
+    date = date if date != None else datetime.date.today()
+    path = os.path.join(snapshot_dir, '{0}{1}.parquet'.format(SNAPSHOT_PREFIX, date.isoformat()))
+    normalize(df).to_parquet(path, index=False)
+    return path
+
+# Return snapshot paths ordered from oldest to newest
+def list_snapshots(snapshot_dir=SNAPSHOT_DIR):
+    return sorted(glob.glob(os.path.join(snapshot_dir, SNAPSHOT_PREFIX + '*.parquet')))
+
+# Load a snapshot, preferring a columnar copy over re-reading an Excel file
+def load_snapshot(path):
+    stem, ext = os.path.splitext(path)
+    if ext == '.parquet':
+        return pd.read_parquet(path)
+    # Reuse the parquet copy of an Excel snapshot if it is at least as new as the spreadsheet
+    cached = stem + '.parquet'
+    if os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(path):
+        return pd.read_parquet(cached)
+    df = normalize(pd.read_excel(path))
+    try:
+        df.to_parquet(cached, index=False)
+    except Exception as e:
+        print("Couldn't cache {0} as parquet: {1}".format(path, e))
+    return df
+
+# uint64 hashes of the same column in two snapshots. Numeric columns are compared as floats, since a column
+# holding 49970000 in one snapshot can be read back as 49970000.0 in the other (e.g. once it has a missing value).
+def hash_columns(old, new):
+    if pd.api.types.is_numeric_dtype(old) and pd.api.types.is_numeric_dtype(new):
+        old, new = old.astype('float64'), new.astype('float64')
+    return pd.util.hash_pandas_object(old, index=False).values, pd.util.hash_pandas_object(new, index=False).values
+
+# Columns that identify a row: (IFI, Project ID), plus the country if either snapshot splits projects into one row per country
+def key_columns(old, new):
+    split = any(ALLOCATION_COLUMN in df.columns and df.duplicated(KEY_COLUMNS).any() for df in (old, new))
+    return KEY_COLUMNS + [ALLOCATION_COLUMN] if split else KEY_COLUMNS
+
+# Compare two snapshots keyed on (IFI, Project ID) and return one row per added, closed or changed project
+# (or per project and country, for projects split across countries).
+# Rows are matched with a hash join, so the cost grows linearly with the number of projects.
+def diff_snapshots(old, new):
+    old, new = normalize(old), normalize(new)
+    keys = key_columns(old, new)
+    for name, df in (('previous', old), ('new', new)):
+        dupes = df.duplicated(keys, keep='last')
+        if dupes.any():
+            print('Ignoring {0} duplicate project keys in the {1} snapshot'.format(dupes.sum(), name))
+    old = old.drop_duplicates(keys, keep='last')
+    new = new.drop_duplicates(keys, keep='last')
+    compare = [c for c in new.columns if c in old.columns and c not in keys]
+
+    # Projects only in one snapshot were added or closed
+    matched = old[keys].merge(new[keys], on=keys, how='outer', indicator=True)
+    added = new.merge(matched[matched['_merge'] == 'right_only'][keys], on=keys).assign(Change='Added')
+    closed = old.merge(matched[matched['_merge'] == 'left_only'][keys], on=keys).assign(Change='Closed')
+
+    # Compare projects in both snapshots column by column. An inner join doesn't add missing values, so column types stay as they were saved.
+    both = old.merge(new, on=keys, how='inner', suffixes=('_old', '_new'))
+    differs = pd.DataFrame(index=both.index)
+    for col in compare:
+        old_hashes, new_hashes = hash_columns(both[col + '_old'], both[col + '_new'])
+        differs[col] = old_hashes != new_hashes
+    changed = both[differs.any(axis=1)].copy()
+    changed['Changed Fields'] = differs.loc[changed.index].apply(lambda row: '; '.join(row.index[row]), axis=1) if len(changed.index) > 0 else []
+    changed['Change'] = 'Re-scoped'
+    if COMMITMENT_COLUMN in compare:
+        changed.loc[differs.loc[changed.index, COMMITMENT_COLUMN], 'Change'] = 'Commitment Changed'
+    if 'Status' in compare:
+        changed.loc[changed['Status_new'].isin(CLOSED_STATUSES) & ~changed['Status_old'].isin(CLOSED_STATUSES), 'Change'] = 'Closed'
+
+    # Report the newest value of descriptive columns and the commitment before and after
+    for col in ['Country', 'Project Title', COMMITMENT_COLUMN]:
+        if col in compare:
+            changed[col] = changed[col + '_new']
+    if COMMITMENT_COLUMN in compare:
+        changed['Previous Commitment (USD)'] = changed[COMMITMENT_COLUMN + '_old']
+        added['Previous Commitment (USD)'] = None
+        closed['Previous Commitment (USD)'] = closed[COMMITMENT_COLUMN]
+        closed[COMMITMENT_COLUMN] = None
+
+    changes = pd.concat([added, closed, changed], ignore_index=True)
+    for col in CHANGE_COLUMNS:
+        if col not in changes.columns:
+            changes[col] = None
+    for col in ['Previous Commitment (USD)', COMMITMENT_COLUMN]:
+        changes[col] = pd.to_numeric(changes[col], errors='coerce')
+    changes['Commitment Change (USD)'] = changes[COMMITMENT_COLUMN].fillna(0) - changes['Previous Commitment (USD)'].fillna(0)
+    if COMMITMENT_COLUMN not in compare:
+        changes['Previous Commitment (USD)'] = changes[COMMITMENT_COLUMN] = changes['Commitment Change (USD)'] = None
+    changes = changes[CHANGE_COLUMNS]
+    return changes.sort_values(['Change'] + keys).reset_index(drop=True)
+
+# Diff two snapshot files (or the two most recent snapshots) and write the changes table
+def write_changes(old_path=None, new_path=None, output_file=CHANGES_FILE):
+    if old_path == None or new_path == None:
+        snapshots = list_snapshots()
+        if len(snapshots) < 2:
+            print('Need at least two snapshots in {0} to report changes'.format(SNAPSHOT_DIR))
+            return None
+        old_path, new_path = snapshots[-2], snapshots[-1]
+    print('Comparing {0} to {1}'.format(old_path, new_path))
+    changes = diff_snapshots(load_snapshot(old_path), load_snapshot(new_path))
+    print(changes['Change'].value_counts().to_string() if len(changes.index) > 0 else 'No changes')
+    changes.to_excel(output_file, index=False, na_rep='', float_format='%.2f')
+    print('Wrote {0} changed projects to {1}'.format(len(changes.index), output_file))
+    return changes
+
+# Main
+if __name__ == '__main__':
+    # Usage: python pipeline/snapshot.py [previous snapshot] [new snapshot]
+    if len(sys.argv) == 3:
+        write_changes(sys.argv[1], sys.argv[2])
+    else:
+        write_changes()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+""" Normalize scraped text (whitespace, transliteration) in batches on a process pool
+"""
+__copyright__ = """
+Copyright 2021 Evans Policy Analysis and Research Group (EPAR).
+"""
+__license__ = """
+This project is licensed under the 3-Clause BSD License. Please see the
+license.txt file for more information.
+"""
+# Imports
+import concurrent.futures
+import functools
+import re
+import unidecode
+
+# Constants
+BATCH_SIZE = 25
+# Each worker process re-imports the scraper and starts with an empty cache, so a couple is plenty
+WORKERS = 2
+CACHE_SIZE = 4096
+WHITESPACE = re.compile(r'\s+')
+# Steps applied to string fields of columns that aren't given their own steps
+DEFAULT_STEPS = ['strip', 'unidecode', 'strip']
+
+# Transliterate to ASCII, caching repeated strings (sectors, statuses, contact names...)
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def transliterate(text):
+    return unidecode.unidecode(text)
+
+STEPS = {
+    'strip': str.strip,
+    'unidecode': transliterate,
+    'collapse': lambda text: WHITESPACE.sub(' ', text),
+}
+
+# Apply the configured steps to every string field of a record
+def normalize_record(record, columns={}, default_steps=DEFAULT_STEPS):
+    clean = {}
+    for key, value in record.items():
+        if type(value) == str:
+            for step in columns.get(key, default_steps):
+                value = STEPS[step](value)
+        clean[key] = value
+    return clean
+
+def normalize_batch(batch, columns={}, default_steps=DEFAULT_STEPS):
+    return [normalize_record(record, columns, default_steps) for record in batch]
+
+# Collects scraped records and normalizes them in batches on a process pool while the crawl continues.
+# columns maps a column name to its list of steps (an empty list leaves the column untouched).
+# Use as a context manager: submit() each record, then results() returns the cleaned records in order.
+# The pool is only started once a full batch is ready, so fewer records than one batch (e.g. debug runs) are normalized in this process.
+class BulkNormalizer:
+    def __init__(self, columns={}, default_steps=DEFAULT_STEPS, workers=WORKERS, batch_size=BATCH_SIZE):
+        self.columns = columns
+        self.default_steps = default_steps
+        self.batch_size = batch_size
+        # workers=0 always normalizes in this process, which is easier to debug
+        self.workers = workers
+        self.pool = None
+        self.batch = []
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.pool != None:
+            self.pool.shutdown()
+
+    def flush(self):
+        if len(self.batch) == 0:
+            return
+        if self.pool == None and self.workers != 0 and len(self.batch) >= self.batch_size:
+            self.pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+        if self.pool != None:
+            self.pending.append(self.pool.submit(normalize_batch, self.batch, self.columns, self.default_steps))
+        else:
+            self.pending.append(normalize_batch(self.batch, self.columns, self.default_steps))
+        self.batch = []
+
+    def submit(self, record):
+        self.batch.append(record)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def results(self):
+        self.flush()
+        records = []
+        for batch in self.pending:
+            records.extend(batch.result() if isinstance(batch, concurrent.futures.Future) else batch)
+        self.pending = []
+        return records
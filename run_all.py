@@ -1,73 +1,194 @@
 #!/usr/bin/env python3
 """ Run all scripts (AfDB, IFAD, WBP, WDI)
+
+Usage: python run_all.py [-debug] [--profile] [scrape|merge|flag|export|analyze] [options]
+Run "python run_all.py <command> -h" to see the options for each command.
 """
 __copyright__ = """
 Copyright 2021 Evans Policy Analysis and Research Group (EPAR).
 """
 __license__ = """
-This project is licensed under the 3-Clause BSD License. Please see the 
+This project is licensed under the 3-Clause BSD License. Please see the
 license.txt file for more information.
 """
 # Imports
+# Only the standard library (and the stdlib-only profiling hooks) is imported here; pandas, the scrapers and
+# the pipeline stages are imported by the commands that need them so the CLI starts quickly
+import argparse
+import importlib
 import os
-import subprocess
 import sys
-import pandas as pd
+from pipeline import profiling
 
 # Constants
-DEBUG = "" if len(sys.argv) == 1 or sys.argv[1] != '-debug' else '-debug'
-# Runs all IFI scrapes if true, otherwise uses already generated IFI data files
-RUN_SCRAPES = False
-
 CLIMATE_SEARCH_STRING = 'climat.*|emissions|(?:energy&(?:green&renewable&clean))| carbon|temperature|greenhouse gas'
 RURAL_AG_ECONOMIES_SECTORS = ['Agricultural Development', 'Agriculuture and Rural Development',
 'Agricultural markets, commercialization and agri-business','Forestry','Rural and Inter-Urban Roads', 'Rural Development'] #iat_funds
 ON_FARM_SECTORS = ['Agricultural Extension, Research, and Other Support Activities','Agriculture','Crops','Fisheries','Fishing','Irrigation and Drainage',
     'Livestock','Other Agriculture, Fishing and Forestry','Public Administration - Agriculture, Fishing & Forestry']  #ag_funds
 IFIS = ["wdi", 'ifad', "wbp", "afdb"] # Ordered from shortest to longest scrape time
-OUTPUT_FILE = 'data/ifi_data.xlsx'
-
-#MAIN
-print('Downloading dependencies')
-subprocess.call('pip install -r requirements.txt -q')
-cwd = os.getcwd()
-print('Current working directory: {0}'.format(cwd))
-
-df = pd.DataFrame()
-#This loop depends on subdirectories/scripts following the naming convention: "./<ifi_name>/<ifi_name>_scrape.py"
-for ifi in IFIS:
-    if RUN_SCRAPES:
+# WDI data not project-level data, don't append to project-level sheet
+PROJECT_IFIS = [ifi for ifi in IFIS if ifi != 'wdi']
+IFI_DATA_FILE = 'data/{0}_data{1}.xlsx'
+OUTPUT_FILE = 'data/ifi_data'
+FORMATS = ['xlsx', 'csv', 'parquet']
+
+# Run the scrapers in-process. This depends on subdirectories/scripts following the naming convention: "./<ifi_name>/<ifi_name>_scrape.py"
+def scrape(ifis=IFIS, debug=False, years=None, pages='live'):
+    from pipeline import crawler
+
+    crawler.configure(pages)
+    for ifi in ifis:
         print("\n====================")
         print('Running {0} scraper'.format(ifi.upper()))
         print("====================\n")
-        code = subprocess.call('python {0}/{0}_scrape.py {1}'.format(ifi, DEBUG))
-        if code == 0:
-            print('{0}_scrape.py ran successfully'.format(ifi))
-        else:
-            print ('{0} scrape returned an error ({1}), see output and {2}_scrape.py for further information.'.format(ifi.upper(), code, ifi))
+        scraper = importlib.import_module('{0}.{0}_scrape'.format(ifi))
+        try:
+            with profiling.stage('scrape_' + ifi):
+                # Only the WDI scraper is parameterized by year
+                if ifi == 'wdi' and years:
+                    scraper.main(debug=debug, years=years)
+                else:
+                    scraper.main(debug=debug)
+        except Exception as e:
+            print('{0} scrape returned an error ({1}), see output and {2}_scrape.py for further information.'.format(ifi.upper(), e, ifi))
             print('Stopping')
-            exit()
-    # WDI data not project-level data, don't append to project-level sheet
-    if ifi != 'wdi':
-        df = pd.concat([df, pd.read_excel('data/{0}_data.xlsx'.format(ifi))], ignore_index=True)
-
-# Generate climate flag (boolean: does climate search string match title, description, or sectors?)
-df['Climate Flag'] = 0
-df.loc[df['Project Title'].fillna(value='').str.contains(CLIMATE_SEARCH_STRING,case=False) ,'Climate Flag'] = 1
-df.loc[df['Description'].fillna(value='').str.contains(CLIMATE_SEARCH_STRING,case=False) ,'Climate Flag'] = 1
-df.loc[df['Primary Sector'].fillna(value='').str.contains(CLIMATE_SEARCH_STRING,case=False) ,'Climate Flag'] = 1
-df.loc[df['Additional Sectors'].fillna(value='').str.contains(CLIMATE_SEARCH_STRING,case=False) ,'Climate Flag'] = 1
-
-# Generate rural/ag economies flag (boolean: is the project in a sector involving on-farm activity? strictly a subset of rural/ag economies below)
-df['On-Farm Flag'] = 0
-df.loc[df['Primary Sector'].fillna(value='').str.contains('|'.join(ON_FARM_SECTORS),case=False) ,'On-Farm Flag'] = 1
-df.loc[df['Additional Sectors'].fillna(value='').str.contains('|'.join(ON_FARM_SECTORS),case=False) ,'On-Farm Flag'] = 1
-
-# Generate rural/ag economies flag (boolean: is the project in a sector involving rural/ag economies?)
-df['Rural/Ag Economies Flag'] = df['On-Farm Flag']
-df.loc[df['Primary Sector'].fillna(value='').str.contains('|'.join(RURAL_AG_ECONOMIES_SECTORS),case=False) ,'Rural/Ag Economies Flag'] = 1
-df.loc[df['Additional Sectors'].fillna(value='').str.contains('|'.join(RURAL_AG_ECONOMIES_SECTORS),case=False) ,'Rural/Ag Economies Flag'] = 1
-
-
-print('All scrapes done -- merging into single spreadsheet. If this step fails, fix the issue, then re-run this script with RUN_SCRAPES set to false to skip scraping the IFI data again!')
-df.to_excel(OUTPUT_FILE, index=True, index_label='#', na_rep='', float_format='%.2f')
\ No newline at end of file
+            raise
+        print('{0}_scrape.py ran successfully'.format(ifi))
+
+# Combine the per-IFI project files into one DataFrame, keeping only projects approved in the given years
+def merge(ifis=PROJECT_IFIS, debug=False, years=None):
+    import pandas as pd
+    from pipeline import dedup
+
+    ifis = [ifi for ifi in ifis if ifi in PROJECT_IFIS]
+    with profiling.stage('merge'):
+        df = pd.concat([pd.read_excel(IFI_DATA_FILE.format(ifi, '_debug' if debug else '')) for ifi in ifis], ignore_index=True)
+        if years:
+            approval_years = df['Approval Date'].astype(str).str.extract(dedup.YEAR, expand=False)
+            df = df[approval_years.isin([str(yr) for yr in years])].reset_index(drop=True)
+
+    # Link co-financed projects listed by more than one IFI so country totals can count them once
+    with profiling.stage('dedup'):
+        df[dedup.CLUSTER_COLUMN] = dedup.cluster_ids(df)
+    print('Linked {0} projects listed under more than one IFI'.format(df[df.duplicated(dedup.CLUSTER_COLUMN, keep=False)][dedup.CLUSTER_COLUMN].nunique()))
+    return df
+
+# Add the climate, on-farm and rural/ag economies flags to the merged data
+def flag(df):
+    # Generate climate flag (boolean: does climate search string match title, description, or sectors?)
+    df['Climate Flag'] = 0
+    df.loc[df['Project Title'].fillna(value='').str.contains(CLIMATE_SEARCH_STRING,case=False) ,'Climate Flag'] = 1
+    df.loc[df['Description'].fillna(value='').str.contains(CLIMATE_SEARCH_STRING,case=False) ,'Climate Flag'] = 1
+    df.loc[df['Primary Sector'].fillna(value='').str.contains(CLIMATE_SEARCH_STRING,case=False) ,'Climate Flag'] = 1
+    df.loc[df['Additional Sectors'].fillna(value='').str.contains(CLIMATE_SEARCH_STRING,case=False) ,'Climate Flag'] = 1
+
+    # Generate rural/ag economies flag (boolean: is the project in a sector involving on-farm activity? strictly a subset of rural/ag economies below)
+    df['On-Farm Flag'] = 0
+    df.loc[df['Primary Sector'].fillna(value='').str.contains('|'.join(ON_FARM_SECTORS),case=False) ,'On-Farm Flag'] = 1
+    df.loc[df['Additional Sectors'].fillna(value='').str.contains('|'.join(ON_FARM_SECTORS),case=False) ,'On-Farm Flag'] = 1
+
+    # Generate rural/ag economies flag (boolean: is the project in a sector involving rural/ag economies?)
+    df['Rural/Ag Economies Flag'] = df['On-Farm Flag']
+    df.loc[df['Primary Sector'].fillna(value='').str.contains('|'.join(RURAL_AG_ECONOMIES_SECTORS),case=False) ,'Rural/Ag Economies Flag'] = 1
+    df.loc[df['Additional Sectors'].fillna(value='').str.contains('|'.join(RURAL_AG_ECONOMIES_SECTORS),case=False) ,'Rural/Ag Economies Flag'] = 1
+    return df
+
+# Write the merged data in each of the requested formats
+def write(df, formats=['xlsx'], output_file=OUTPUT_FILE):
+    from pipeline import listing
+
+    for fmt in formats:
+        path = '{0}.{1}'.format(output_file, fmt)
+        print('Writing ' + path)
+        with profiling.stage('write_' + fmt):
+            if fmt == 'xlsx':
+                df.to_excel(path, index=True, index_label='#', na_rep='', float_format='%.2f')
+            elif fmt == 'csv':
+                df.to_csv(path, index=True, index_label='#', float_format='%.2f')
+            elif fmt == 'parquet':
+                # Only fix mixed-type columns; unlike snapshots, the export keeps every column (including Cluster ID)
+                listing.normalize(df.copy()).to_parquet(path, index=False)
+
+# Write the merged, flagged data and keep a columnar snapshot of this run for change reports
+def export(df, formats=['xlsx'], output_file=OUTPUT_FILE, save_snapshot=True):
+    from pipeline import snapshot
+
+    write(df, formats, output_file)
+    if save_snapshot:
+        with profiling.stage('snapshot'):
+            print('Saved snapshot ' + snapshot.save_snapshot(df))
+
+# Report what changed between two snapshots (by default the two most recent ones)
+def analyze(old_snapshot=None, new_snapshot=None):
+    from pipeline import snapshot
+
+    with profiling.stage('analyze'):
+        return snapshot.write_changes(old_snapshot, new_snapshot)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Scrape IFI project data and compile it into a single spreadsheet. '
+        'With no command, merges the existing IFI data files, flags them, exports them and reports changes since the last run.')
+    parser.add_argument('-debug', '--debug', action='store_true', help='visit only the first few projects and use the *_debug data files')
+    parser.add_argument('-profile', '--profile', action='store_true',
+        help='write cProfile and memory reports for each stage to {0}'.format(profiling.PROFILE_DIR))
+    commands = parser.add_subparsers(dest='command')
+
+    scrape_parser = commands.add_parser('scrape', help='run the IFI scrapers')
+    scrape_parser.add_argument('--ifi', nargs='+', choices=IFIS, default=IFIS, help='IFIs to scrape (default: all)')
+    scrape_parser.add_argument('--years', nargs='+', type=int, help='years of WDI indicators to download')
+    scrape_parser.add_argument('--pages', choices=['live', 'record', 'replay'], default='live',
+        help='download pages (live), also save them to data/cache/pages (record), or only use saved pages (replay)')
+
+    for name, description in [('merge', 'combine the scraped IFI data files'), ('flag', 'merge and add climate and agriculture flags'),
+            ('export', 'merge, flag and export the data, saving a snapshot for change reports')]:
+        stage_parser = commands.add_parser(name, help=description)
+        stage_parser.add_argument('--ifi', nargs='+', choices=PROJECT_IFIS, default=PROJECT_IFIS, help='IFIs to include (default: all)')
+        stage_parser.add_argument('--years', nargs='+', type=int, help='only include projects approved in these years')
+        stage_parser.add_argument('--format', nargs='+', choices=FORMATS, default=['xlsx'], help='output formats (default: xlsx)')
+        stage_parser.add_argument('--output', default=OUTPUT_FILE, help='output file name without extension (default: {0})'.format(OUTPUT_FILE))
+
+    analyze_parser = commands.add_parser('analyze', help='report projects that changed between two snapshots')
+    analyze_parser.add_argument('snapshots', nargs='*', help='previous and new snapshot files (default: the two most recent snapshots)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    print('Current working directory: {0}'.format(os.getcwd()))
+    if args.profile:
+        profiling.enable()
+
+    if args.command == 'scrape':
+        scrape(args.ifi, args.debug, args.years, args.pages)
+    elif args.command in ['merge', 'flag', 'export']:
+        df = merge(args.ifi, args.debug, args.years)
+        if args.command == 'merge':
+            write(df, args.format, args.output)
+            return
+        with profiling.stage('flag'):
+            df = flag(df)
+        if args.command == 'flag':
+            write(df, args.format, args.output)
+            return
+        print('All scrapes done -- merging into single spreadsheet. If this step fails, fix the issue, then re-run "python run_all.py export" to skip scraping the IFI data again!')
+        # Only full runs are snapshotted, otherwise the next change report would list every left-out project as closed
+        full_run = not args.debug and args.years is None and set(args.ifi) == set(PROJECT_IFIS)
+        if not full_run:
+            print('Not saving a snapshot because only some IFIs, years or debug data were exported')
+        export(df, args.format, args.output, full_run)
+    elif args.command == 'analyze':
+        if len(args.snapshots) not in [0, 2]:
+            sys.exit('analyze takes either no snapshots or a previous and a new snapshot')
+        analyze(*args.snapshots)
+    else:
+        df = merge(debug=args.debug)
+        with profiling.stage('flag'):
+            df = flag(df)
+        export(df, save_snapshot=not args.debug)
+        # Debug runs don't save a snapshot, so there is nothing new to compare
+        if not args.debug:
+            analyze()
+
+# Main
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+# Make the pipeline package importable when pytest is run from any directory
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pandas as pd
+import pytest
+
+# Builds a DataFrame of projects from a list of columns and a list of rows
+@pytest.fixture
+def projects():
+    return lambda columns, rows: pd.DataFrame(rows, columns=columns)
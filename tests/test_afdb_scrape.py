@@ -0,0 +1,10 @@
+import pandas as pd
+from afdb import afdb_scrape
+
+def test_unknown_dac_codes_are_not_available(monkeypatch):
+    lookup = pd.DataFrame({'DAC 5 CODE': [311, None], 'concatenate': [None, 31120], 'DESCRIPTION': ['Agriculture', 'Agricultural development']})
+    monkeypatch.setattr(afdb_scrape, 'DAC_LOOKUP', lookup)
+    assert afdb_scrape.get_dac5_desc('311') == 'Agriculture'
+    assert afdb_scrape.get_dac5_desc('31120') == 'Agricultural development'
+    assert afdb_scrape.get_dac5_desc('99999') == 'N/A'
+    assert afdb_scrape.get_dac5_desc('N/A') == 'N/A'
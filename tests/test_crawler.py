@@ -0,0 +1,14 @@
+from pipeline import crawler
+
+def test_missing_fields_are_reported(capsys):
+    fields = [crawler.Field('Title', crawler.select('h1')), crawler.Field('Sector', crawler.table('Sector'))]
+    c = crawler.Crawler('demo', '{0}', fields)
+    record = c.extract(c.parse('<html><body><h1>Rural Roads</h1></body></html>'), 'P1')
+    assert record == {'Title': 'Rural Roads', 'Sector': None}
+    assert 'demo P1: Sector not found' in capsys.readouterr().out
+
+def test_json_strings_are_unescaped():
+    fields = [crawler.Field('Project Contact', crawler.json_path('projects', None, 'teamleadname'))]
+    c = crawler.Crawler('demo', '{0}', fields, parser='json')
+    page = c.parse('{"projects": {"P1": {"teamleadname": "Fran&#231;ois O&#39;Brien", "count": 1}}}')
+    assert c.extract(page, 'P1') == {'Project Contact': "François O'Brien"}
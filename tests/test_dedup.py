@@ -0,0 +1,28 @@
+from pipeline import dedup
+
+COLUMNS = ['IFI', 'Country', 'Approval Date', 'Project Title']
+
+def test_links_cofinanced_project(projects):
+    df = projects(COLUMNS, [
+        ['World Bank', 'Kenya', '2019-05-01', 'Kenya Rural Roads Project'],
+        ['African Development Bank', 'Kenya', '2019-06-10', 'Kenya Rural Roads Project'],
+        ['World Bank', 'Kenya', '2019-07-01', 'Urban Water Supply'],
+    ])
+    ids = dedup.cluster_ids(df)
+    assert ids[0] == ids[1]
+    assert ids[2] != ids[0]
+
+# A listing from another IFI that matches two phases of one IFI's project must not merge the phases
+def test_never_clusters_two_projects_from_one_ifi(projects):
+    df = projects(COLUMNS, [
+        ['World Bank', 'Kenya', '2019-05-01', 'Kenya Rural Roads Project Phase I'],
+        ['World Bank', 'Kenya', '2019-05-01', 'Kenya Rural Roads Project Phase II'],
+        ['African Development Bank', 'Kenya', '2019-06-10', 'Kenya Rural Roads Project'],
+        ['International Fund for Agricultural Development', 'Kenya', '2019-08-12', 'Kenya Rural Roads Project'],
+    ])
+    df['Cluster ID'] = dedup.cluster_ids(df)
+    assert df.groupby('Cluster ID')['IFI'].apply(lambda ifis: ifis.is_unique).all()
+    assert df['Cluster ID'][0] != df['Cluster ID'][1]
+    # The AfDB and IFAD listings are still linked to one of the phases
+    assert df['Cluster ID'][2] == df['Cluster ID'][3]
+    assert df['Cluster ID'][2] in (df['Cluster ID'][0], df['Cluster ID'][1])
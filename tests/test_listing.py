@@ -0,0 +1,52 @@
+import openpyxl
+import pandas as pd
+from pipeline import listing
+
+# A project list with a title row above the header, like the WB export (header=1)
+def write_listing(path, rows):
+    book = openpyxl.Workbook()
+    sheet = book.active
+    sheet.append(['World Bank Projects'])
+    sheet.append(['Project ID', 'Country', 'Grant Amount', 'Region'])
+    for row in rows:
+        sheet.append(row)
+    book.save(path)
+
+ROWS = [
+    ['P1', 'Kenya', 100.0, 'AFR'],
+    ['P2', 'Ghana', 250.5, 'AFR'],
+    ['P3', 'Kenya', None, 'AFR'],
+    ['P4', 'Kenya', None, 'AFR'],
+    ['P5', 'Peru', 10.0, 'LCR'],
+]
+
+def test_reads_header_offset_and_filters(tmp_path):
+    path = str(tmp_path / 'projects.xlsx')
+    write_listing(path, ROWS)
+    df = listing.read_listing(path, ['Project ID', 'Grant Amount'], filters={'Country': ['Kenya', 'Ghana']},
+        header=1, cache_dir=str(tmp_path / 'cache'))
+    assert df['Project ID'].tolist() == ['P1', 'P2', 'P3', 'P4']
+    assert 'Region' not in df.columns
+
+# With chunks of two rows, the P3/P4 chunk has no grant amounts at all; the column must stay numeric
+def test_all_blank_chunk_keeps_numbers(tmp_path):
+    path = str(tmp_path / 'projects.xlsx')
+    write_listing(path, ROWS)
+    df = listing.read_listing(path, ['Project ID', 'Grant Amount'], header=1, chunk_size=2, cache_dir=str(tmp_path / 'cache'))
+    assert pd.api.types.is_float_dtype(df['Grant Amount'])
+    assert (df['Grant Amount'] + 1.0).tolist()[:2] == [101.0, 251.5]
+
+def test_cache_hit_skips_reading_the_spreadsheet(tmp_path, monkeypatch):
+    path = str(tmp_path / 'projects.xlsx')
+    write_listing(path, ROWS)
+    first = listing.read_listing(path, ['Project ID'], header=1, cache_dir=str(tmp_path / 'cache'))
+    def fail(*args):
+        raise AssertionError('spreadsheet read again')
+    monkeypatch.setattr(listing, 'xlsx_chunks', fail)
+    second = listing.read_listing(path, ['Project ID'], header=1, cache_dir=str(tmp_path / 'cache'))
+    pd.testing.assert_frame_equal(first, second)
+
+def test_normalize_only_converts_mixed_text_columns():
+    df = listing.normalize(pd.DataFrame({'id': [1, 'P2', None], 'amount': pd.Series([1.5, None, None], dtype=object)}))
+    assert df['id'].tolist() == ['1', 'P2', None]
+    assert df['amount'].tolist()[0] == 1.5
@@ -0,0 +1,63 @@
+import pandas as pd
+import pytest
+from pipeline import snapshot
+
+COLUMNS = ['IFI', 'Project ID', 'Country', 'Project Title', 'Status', 'Commitment Amount (USD)', 'Climate Flag']
+
+@pytest.fixture
+def old(projects):
+    return projects(COLUMNS, [
+        ['World Bank', 'P1', 'Kenya', 'Rural Roads', 'Active', 49970000, 0],
+        ['World Bank', 'P2', 'Ghana', 'Water Supply', 'Active', 12000000, 1],
+        ['World Bank', 'P3', 'Mali', 'Irrigation', 'Active', 30000000, 0],
+    ])
+
+def change_of(changes, project_id):
+    return changes[changes['Project ID'] == project_id].iloc[0]
+
+# A dropped project must not make int columns of the other projects look changed
+def test_title_edit_with_dropped_project(old, projects):
+    new = projects(COLUMNS, [
+        ['World Bank', 'P1', 'Kenya', 'Rural Roads Phase I', 'Active', 49970000, 0],
+        ['World Bank', 'P2', 'Ghana', 'Water Supply', 'Active', 12000000, 1],
+    ])
+    changes = snapshot.diff_snapshots(old, new)
+    assert sorted(changes['Project ID']) == ['P1', 'P3']
+    renamed = change_of(changes, 'P1')
+    assert renamed['Change'] == 'Re-scoped'
+    assert renamed['Changed Fields'] == 'Project Title'
+    assert renamed['Commitment Change (USD)'] == 0
+    assert change_of(changes, 'P3')['Change'] == 'Closed'
+
+# An added project with no commitment turns the new commitment column into floats
+def test_title_edit_with_added_project(old, projects):
+    new = pd.concat([old, projects(COLUMNS, [['World Bank', 'P4', 'Chad', 'Health', 'Pipeline', float('nan'), 0]])], ignore_index=True)
+    new.loc[new['Project ID'] == 'P2', 'Project Title'] = 'Water Supply II'
+    changes = snapshot.diff_snapshots(old, new)
+    assert sorted(changes['Project ID']) == ['P2', 'P4']
+    assert change_of(changes, 'P2')['Changed Fields'] == 'Project Title'
+    assert change_of(changes, 'P4')['Change'] == 'Added'
+
+def test_commitment_change(old):
+    new = old.copy()
+    new.loc[new['Project ID'] == 'P3', 'Commitment Amount (USD)'] = 35000000
+    changes = snapshot.diff_snapshots(old, new)
+    changed = change_of(changes, 'P3')
+    assert len(changes.index) == 1
+    assert changed['Change'] == 'Commitment Changed'
+    assert changed['Commitment Change (USD)'] == 5000000
+
+# Multi-region projects split into one row per country are compared country by country
+def test_exploded_projects_keyed_by_country(projects):
+    old = projects(COLUMNS, [
+        ['World Bank', 'P9', 'Kenya', 'Regional Trade', 'Active', 10000000, 0],
+        ['World Bank', 'P9', 'Uganda', 'Regional Trade', 'Active', 10000000, 0],
+    ])
+    new = projects(COLUMNS, [
+        ['World Bank', 'P9', 'Kenya', 'Regional Trade', 'Active', 10000000, 0],
+        ['World Bank', 'P9', 'Uganda', 'Regional Trade', 'Active', 12000000, 0],
+        ['World Bank', 'P9', 'Rwanda', 'Regional Trade', 'Active', 5000000, 0],
+    ])
+    changes = snapshot.diff_snapshots(old, new)
+    assert sorted(zip(changes['Country'], changes['Change'])) == [('Rwanda', 'Added'), ('Uganda', 'Commitment Changed')]
+    assert changes[changes['Country'] == 'Uganda']['Commitment Change (USD)'].iloc[0] == 2000000
@@ -0,0 +1,34 @@
+from pipeline import textclean
+
+def test_normalize_record_steps_per_column():
+    record = {'Country': "  Côte d'Ivoire ", 'Title': '  Résilience   rurale ', 'Amount': 5}
+    clean = textclean.normalize_record(record, {'Country': [], 'Title': ['strip', 'collapse']})
+    assert clean == {'Country': "  Côte d'Ivoire ", 'Title': 'Résilience rurale', 'Amount': 5}
+    assert textclean.normalize_record({'Title': ' Résilience '}) == {'Title': 'Resilience'}
+
+def test_bulk_normalizer_in_process_keeps_order():
+    records = [{'Project ID': i, 'Title': ' Projet n°{0} '.format(i)} for i in range(7)]
+    with textclean.BulkNormalizer(workers=0, batch_size=3) as normalizer:
+        for record in records:
+            normalizer.submit(record)
+        results = normalizer.results()
+    assert normalizer.pool is None
+    assert [r['Project ID'] for r in results] == list(range(7))
+    assert results[4]['Title'] == 'Projet ndeg4'
+
+def test_bulk_normalizer_pool_keeps_order_across_batches():
+    records = [{'Project ID': i, 'Country': 'Bénin', 'Title': ' Étude {0} '.format(i)} for i in range(10)]
+    with textclean.BulkNormalizer({'Country': []}, workers=2, batch_size=3) as normalizer:
+        for record in records:
+            normalizer.submit(record)
+        results = normalizer.results()
+    assert [r['Project ID'] for r in results] == list(range(10))
+    assert results[9] == {'Project ID': 9, 'Country': 'Bénin', 'Title': 'Etude 9'}
+
+# Fewer records than one batch never start a pool
+def test_bulk_normalizer_small_runs_stay_in_process():
+    with textclean.BulkNormalizer(batch_size=25) as normalizer:
+        for i in range(5):
+            normalizer.submit({'Title': ' Título '})
+        assert [r['Title'] for r in normalizer.results()] == ['Titulo'] * 5
+    assert normalizer.pool is None
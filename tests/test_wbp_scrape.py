@@ -0,0 +1,16 @@
+import pandas as pd
+from wbp import wbp_scrape
+
+def test_extract_countries_whole_names_only():
+    descriptions = pd.Series([
+        'Support to Niger, Nigeria and Guinea-Bissau',
+        'Fisheries in Papua New Guinea and the Gulf of Guinea',
+        'Roads in Equatorial Guinea and Guinea',
+        None,
+    ])
+    assert wbp_scrape.extract_countries(descriptions).tolist() == [
+        ['Niger', 'Nigeria', 'Guinea-Bissau'],
+        [],
+        ['Equatorial Guinea', 'Guinea'],
+        [],
+    ]
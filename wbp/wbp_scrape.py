@@ -19,25 +19,32 @@ license.txt file for more information.
 """
 
 # Imports
-import html
-import json
+import os
 import pandas as pd
+import re
 import requests
 import sys
-import time
-from bs4 import BeautifulSoup
+
+# Make the shared pipeline package importable when this script is run directly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline import crawler, listing, profiling
 
 # Constants
-DEBUG = False if len(sys.argv) == 1 else sys.argv[1] == "-debug"
+DEBUG = "-debug" in sys.argv
 DEBUG_NUM_PROJECTS = 5
 PROJECT_LIST_URL = 'https://search.worldbank.org/api/projects/all.xls'
 CWD = "./data/"
 PROJECT_LIST = CWD + 'wbp_unfiltered.xls'
-FILTERED_PROJECT_LIST = CWD +'wbp_data_debug.xlsx' if DEBUG else CWD + 'wbp_data.xlsx'
+FILTERED_PROJECT_LIST = CWD + 'wbp_data.xlsx'
+DEBUG_FILTERED_PROJECT_LIST = CWD + 'wbp_data_debug.xlsx'
 PROJECT_API = "http://search.worldbank.org/api/v2/projects?format=json&fl=id,teamleadname&id="
 DROP_COLUMNS = ['Region', 'Consultant Services Required', 'IBRD Commitment ', 'IDA Commitment', 'Grant Amount',
     'Environmental Assessment Category','Environmental and Social Risk', 'Total IDA and IBRD Commitment', 'Implementing Agency', 'Financing Type',
     'Borrower', 'Lending Instrument','Current Project Cost', 'Project URL']
+# Columns read from the project list (everything else in the export is ignored)
+PROJECT_LIST_COLUMNS = ['Project ID', 'Country', 'Project Name', 'Project Status', 'Project Development Objective ',
+    'Board Approval Date', 'Project Closing Date', 'Sector 1', 'Sector 2', 'Sector 3', 'Theme 1', 'Theme 2',
+    'Total IDA and IBRD Commitment', 'Grant Amount']
 RENAME_COLUMNS = {'Project Name': 'Project Title', 'Project Status':'Status', 'Project Development Objective ':'Description', 
     'Project Closing Date':'Closing Date', 'Board Approval Date': 'Approval Date', 'Sector 1' : 'Primary Sector'}
 
@@ -98,91 +105,142 @@ IFI_COUNTRIES = {
 }
 # Add Western Africa, Eastern African, Southern Africa, Central Africa
 MULTI_REGION = ['World']
+# Split multi-region commitments evenly across the countries named in their descriptions (one row per country)
+EXPLODE_MULTI_REGION = False
+# Other spellings of IFI country names that show up in project descriptions
+COUNTRY_ALIASES = {
+    "Cote d'Ivoire" : "Côte d'Ivoire",
+    'The Gambia' : 'Gambia',
+    'Congo, Democratic Republic of' : 'Democratic Republic of the Congo',
+    'Congo, Republic of' : 'Republic of the Congo',
+    'Swaziland' : 'Eswatini',
+    'Cape Verde' : 'Cabo Verde'
+}
+# Names that contain an IFI country name but aren't that country; they are matched so the country inside them isn't
+EXCLUDED_NAMES = ['Papua New Guinea', 'Gulf of Guinea', 'New Guinea']
+REGIONS = ['Eastern Africa', 'Western Africa', 'Central Africa', 'Southern Africa', 'Multinational']
+COUNTRY_NAMES = {name : name for name in IFI_COUNTRIES.values() if name not in REGIONS}
+COUNTRY_NAMES.update(COUNTRY_ALIASES)
+COUNTRY_NAMES.update({name : None for name in EXCLUDED_NAMES})
+# Longest names first so 'Equatorial Guinea' and 'Papua New Guinea' win over 'Guinea', and whole words only so 'Niger' doesn't match 'Nigeria'
+COUNTRY_PATTERN = re.compile(r"(?<![\w-])(?:" + '|'.join(re.escape(name) for name in sorted(COUNTRY_NAMES, key=len, reverse=True)) + r")(?![\w-])")
 
-def get_html(url):
-    attempts = 0
-    while(attempts < 20):
-        try:
-            attempts += 1
-            response = requests.get(url)
-            clean_html = html.unescape(response.text)
-            return BeautifulSoup(clean_html, 'html.parser')
-        except (Exception) as e:
-            print('Failed to download webpage, trying again')
-            time.sleep(5)
-    return None    
+# Returns the list of IFI countries named in each description (without duplicates, in order of appearance)
+def extract_countries(descriptions):
+    matches = descriptions.fillna(value='').str.findall(COUNTRY_PATTERN)
+    return matches.map(lambda names: list(dict.fromkeys(COUNTRY_NAMES[name] for name in names if COUNTRY_NAMES[name] != None)))
 
-# Main
-if not DEBUG:
+# Returns one row per matched country with the commitment split evenly between them
+def explode_countries(df):
+    df = df.assign(Country=df['Multi-Region Countries']).explode('Country')
+    df['Commitment Amount (USD)'] = df['Commitment Amount (USD)'] / df['Multi-Region Countries'].str.len()
+    return df.reset_index(drop=True)
+
+# Downloads the current list of WB projects
+def download_wb_projects_list(project_list=PROJECT_LIST):
     # Download the excel spreadsheet from the world bank website
     print("Downloading projects spreadsheet from the WB website")
     r = requests.get(PROJECT_LIST_URL)
     print("Download complete!")
-    unfiltered_projs = open(PROJECT_LIST, 'wb')
+    unfiltered_projs = open(project_list, 'wb')
     unfiltered_projs.write(r.content)
     unfiltered_projs.close()
-    print("Writing unfiltered projects to " + PROJECT_LIST)
-
-print("Filtering to active projects in IFI countries")
-# Read in the unfiltered list of projects
-df = pd.read_excel(PROJECT_LIST, header=1)
-
-df['IFI'] = 'World Bank'
-# Commitment amount = IDA + IBRD + grant amounts. (Do this before dropping the Total & Grant columns)
-df['Commitment Amount (USD)'] = df['Total IDA and IBRD Commitment'] + df['Grant Amount']
-#Drop unneeded indicators and rename others
-df.drop(DROP_COLUMNS, axis=1, inplace=True)
-df.rename(columns=RENAME_COLUMNS, inplace=True)
-# Drop non-IFI countries
-df = df[df['Country'].isin(list(IFI_COUNTRIES.keys()) + MULTI_REGION)]
-# Standardize country names to IFI project format
-df = df.replace(IFI_COUNTRIES)
-# Drop inactive projects (possible states: Active*, Pipeline*, Dropped, Closed)
-df = df[df['Status'].isin(['Active', 'Pipeline'])]
-
-# Drop world and multi-regional projects without an IFI country name in the description
-# Get multiregion projects
-multiregion = df[((df['Country'] == 'World') | (df['Country'] == 'Multinational'))]
-# Drop multiregion projects that don't have any IFI countries in the description
-to_drop = multiregion[~multiregion['Description'].fillna(value="").str.contains('|'.join(list(IFI_COUNTRIES.values())))]
-df = pd.concat([df, to_drop, to_drop]).drop_duplicates(keep=False)
-print("Keeping " + str(len(multiregion.index) - len(to_drop.index)) + " multi-region/world projects related to IFI countries (out of " + str(len(multiregion.index)) + ")")
-
-# Calculate duration
-df['Approval Date'] = pd.to_datetime(df['Approval Date'], infer_datetime_format=True).dt.tz_localize(None)
-df['Closing Date'] = pd.to_datetime(df['Closing Date'], infer_datetime_format=True).dt.tz_localize(None)
-
-# project duration = closing date - board approval date (in years, rounded to 2 decimals)
-# (only populated if there *is* a closing date, otherwise duration is null)
-df['Project Duration'] = df.apply(lambda x: round((x['Closing Date'] - x['Approval Date']).days / 365.25, 2) if pd.notnull(x['Closing Date']) else None, axis=1)
-
-# Remove time from dates
-df['Approval Date'] = df['Approval Date'].dt.date
-df['Closing Date'] = df['Closing Date'].dt.date
-
-# Combine sectors 2 & 3 and themes 1 & 2 into Additional Sectors
-sector_df = df.filter(['Sector 2', 'Sector 3', 'Theme 1', 'Theme 2'], axis=1)
-sector_df = sector_df.apply(lambda x: None if x.isnull().all() else '; '.join(x.dropna()), axis=1)
-df['Additional Sectors'] = sector_df
-df.drop(columns=[ 'Sector 2', 'Sector 3', 'Theme 1', 'Theme 2'], axis=1, inplace=True)
-
-# index indexes into the df but has skips, count is a sequential counter with no relation to the df
-count = 0
-for index, row in df.iterrows():
-    if DEBUG:
-        print("Getting contact information for #{0}, project ID {1}".format(count, row["Project ID"]))
-    response = json.loads(get_html(PROJECT_API + row['Project ID']).text)
-    team_lead = response['projects'][row['Project ID']]['teamleadname']
-    team_lead = team_lead.replace(',', ', ').replace('NIL', '')
-    if DEBUG:
-        print(team_lead)
-    df.at[index, 'Project Contact'] = team_lead
-    count = count + 1
-    # Only run for 20 if debugging
-    if DEBUG and count >= DEBUG_NUM_PROJECTS:
-        break
-
-# Write to output file
-print("Writing the filtered project list to " + FILTERED_PROJECT_LIST)
-df.to_excel(open(FILTERED_PROJECT_LIST, 'wb'), index=False, na_rep='')
-print("Done")
\ No newline at end of file
+    print("Writing unfiltered projects to " + project_list)
+
+# Filter the unfiltered WB project list to active projects in IFI countries and standardize its columns
+def filter_projects(df):
+    df['IFI'] = 'World Bank'
+    # Commitment amount = IDA + IBRD + grant amounts. (Do this before dropping the Total & Grant columns)
+    df['Commitment Amount (USD)'] = df['Total IDA and IBRD Commitment'] + df['Grant Amount']
+    #Drop unneeded indicators and rename others
+    df.drop(DROP_COLUMNS, axis=1, inplace=True, errors='ignore')
+    df.rename(columns=RENAME_COLUMNS, inplace=True)
+    # Drop non-IFI countries
+    df = df[df['Country'].isin(list(IFI_COUNTRIES.keys()) + MULTI_REGION)]
+    # Standardize country names to IFI project format
+    df = df.replace(IFI_COUNTRIES)
+    # Drop inactive projects (possible states: Active*, Pipeline*, Dropped, Closed)
+    df = df[df['Status'].isin(['Active', 'Pipeline'])]
+
+    # Record which IFI countries each world and multi-regional project names in its description
+    is_multiregion = (df['Country'] == 'World') | (df['Country'] == 'Multinational')
+    df['Multi-Region Countries'] = extract_countries(df['Description']).where(is_multiregion, None)
+    # Drop multiregion projects that don't have any IFI countries in the description
+    to_drop = is_multiregion & (df['Multi-Region Countries'].str.len() == 0)
+    df = df[~to_drop]
+    print("Keeping " + str(is_multiregion.sum() - to_drop.sum()) + " multi-region/world projects related to IFI countries (out of " + str(is_multiregion.sum()) + ")")
+    if EXPLODE_MULTI_REGION:
+        df = pd.concat([df[df['Multi-Region Countries'].isna()], explode_countries(df[df['Multi-Region Countries'].notna()])], ignore_index=True)
+    df['Multi-Region Countries'] = df['Multi-Region Countries'].str.join('; ')
+
+    # Calculate duration
+    df['Approval Date'] = pd.to_datetime(df['Approval Date'], infer_datetime_format=True).dt.tz_localize(None)
+    df['Closing Date'] = pd.to_datetime(df['Closing Date'], infer_datetime_format=True).dt.tz_localize(None)
+
+    # project duration = closing date - board approval date (in years, rounded to 2 decimals)
+    # (only populated if there *is* a closing date, otherwise duration is null)
+    df['Project Duration'] = df.apply(lambda x: round((x['Closing Date'] - x['Approval Date']).days / 365.25, 2) if pd.notnull(x['Closing Date']) else None, axis=1)
+
+    # Remove time from dates
+    df['Approval Date'] = df['Approval Date'].dt.date
+    df['Closing Date'] = df['Closing Date'].dt.date
+
+    # Combine sectors 2 & 3 and themes 1 & 2 into Additional Sectors
+    sector_df = df.filter(['Sector 2', 'Sector 3', 'Theme 1', 'Theme 2'], axis=1)
+    sector_df = sector_df.apply(lambda x: None if x.isnull().all() else '; '.join(x.dropna()), axis=1)
+    df['Additional Sectors'] = sector_df
+    df.drop(columns=[ 'Sector 2', 'Sector 3', 'Theme 1', 'Theme 2'], axis=1, inplace=True)
+    return df
+
+# Fields read from the WB projects API for each project (see pipeline/crawler.py)
+CONTACT_FIELDS = [
+    crawler.Field('Project ID', crawler.item_id()),
+    crawler.Field('Project Contact', crawler.json_path('projects', None, 'teamleadname'),
+        lambda team_lead: team_lead.replace(',', ', ').replace('NIL', '')),
+]
+
+# Look up each project's team lead from the WB projects API
+def add_contacts(df, debug=False):
+    project_ids = df['Project ID'].tolist()
+    # Only run for the first few projects if debugging
+    if debug:
+        project_ids = project_ids[:DEBUG_NUM_PROJECTS]
+    contact_crawler = crawler.Crawler('wbp', PROJECT_API + '{0}', CONTACT_FIELDS, parser='json', workers=8)
+    with profiling.stage('wbp_contacts'):
+        contacts = {data['Project ID']: data['Project Contact'] for data in contact_crawler.crawl(project_ids)}
+    if debug:
+        [print(project_id, ':', team_lead) for project_id, team_lead in contacts.items()]
+    df['Project Contact'] = df['Project ID'].map(contacts)
+    return df
+
+# Download and filter the WB project list and return it as a DataFrame
+def scrape(debug=False):
+    if not debug and crawler.MODE != 'replay':
+        download_wb_projects_list()
+
+    print("Filtering to active projects in IFI countries")
+    # Read in the needed columns of active projects in IFI countries from the unfiltered list of projects
+    with profiling.stage('wbp_listing'):
+        df = listing.read_listing(PROJECT_LIST, PROJECT_LIST_COLUMNS, header=1,
+            filters={'Country': list(IFI_COUNTRIES.keys()) + MULTI_REGION, 'Project Status': ['Active', 'Pipeline']})
+    with profiling.stage('wbp_filter'):
+        df = filter_projects(df)
+    return add_contacts(df, debug)
+
+# Scrape WB projects and write them to the output Excel file
+def main(debug=DEBUG):
+    df = scrape(debug)
+    output_file = DEBUG_FILTERED_PROJECT_LIST if debug else FILTERED_PROJECT_LIST
+
+    # Write to output file
+    print("Writing the filtered project list to " + output_file)
+    with profiling.stage('wbp_write'):
+        df.to_excel(output_file, index=False, na_rep='')
+    print("Done")
+    return df
+
+# Main
+if __name__ == '__main__':
+    crawler.configure_from_args(sys.argv)
+    profiling.enable_from_args(sys.argv)
+    main()
@@ -20,15 +20,21 @@ license.txt file for more information.
 
 # Imports
 import csv
-import requests
+import json
+import os
 import sys
 
+# Make the shared pipeline package importable when this script is run directly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline import crawler, profiling
+
 # Constants
-DEBUG = False if len(sys.argv) == 1 else sys.argv[1] == "-debug"
+DEBUG = "-debug" in sys.argv
 API_BASE = 'http://api.worldbank.org/v2/country/{ctry}/indicator/{ind}?date={yr}&format=json'
 YEARS = ['2009', '2010']
 INDICATOR_CSV = './wdi/wdi_inds.csv'
-OUTPUT_CSV = './data/wdi_data_debug.csv' if DEBUG else './data/wdi_data.csv'
+OUTPUT_CSV = './data/wdi_data.csv'
+DEBUG_OUTPUT_CSV = './data/wdi_data_debug.csv'
 ISO_CODES = {
     'AGO': 'Angola',
     'BEN': 'Benin',
@@ -79,28 +85,44 @@ ISO_CODES = {
 }
 
 # Use a shorter list of countries if debugging
-ISO_CODES = {'AGO':'Angola', 'ETH': 'Ethiopia', 'SSD': 'South Sudan'} if DEBUG else ISO_CODES
+DEBUG_ISO_CODES = {'AGO':'Angola', 'ETH': 'Ethiopia', 'SSD': 'South Sudan'}
+
+# Request every indicator for the given countries and years and return the rows and column names
+def scrape(iso_codes=ISO_CODES, years=YEARS):
+    # Get dictionary of indicators from csv file
+    with open(INDICATOR_CSV) as f:
+        inds = {r["code"] : r["name"] for r in csv.DictReader(f) if r != ""}
+    # Initialize output data dictionary in the following format for all countries: 
+    #   "{ISO CODE: {'iso': ISO CODE, 'country': COUNTRY NAME}}"
+    data = {key: {'iso': key, 'country': value} for key, value in iso_codes.items()}
+    fields = {"iso": True, "country": True}
+
+    # Request all country data for each indicator and year
+    for ind, name in inds.items():
+        for yr in years:
+            resp = json.loads(crawler.fetch(API_BASE.format(ctry = ';'.join(iso_codes.keys()), ind = ind, yr = yr)))[1]
+            for c in resp:
+                field = name + "_" + c["date"]
+                fields[field] = True
+                data[c["countryiso3code"]][field] = c['value']
+    return data, list(fields.keys())
 
-# Get dictionary of indicators from csv file
-inds = {r["code"] : r["name"] for r in csv.DictReader(open(INDICATOR_CSV)) if r != ""}
-# Initialize output data dictionary in the following format for all countries: 
-#   "{ISO CODE: {'iso': ISO CODE, 'country': COUNTRY NAME}}"
-data = {key: {'iso': key, 'country': value} for key, value in ISO_CODES.items()}
-fields = {"iso": True, "country": True}
+# Download WDI indicators and write them to the output csv file
+def main(debug=DEBUG, years=YEARS):
+    with profiling.stage('wdi_download'):
+        data, fields = scrape(DEBUG_ISO_CODES if debug else ISO_CODES, [str(yr) for yr in years])
 
-# Request all country data for each indicator and year
-for ind, name in inds.items():
-    for yr in YEARS:
-        resp = requests.get(API_BASE.format(ctry = ';'.join(ISO_CODES.keys()), ind = ind, yr = yr)).json()[1]
-        for c in resp:
-            field = name + "_" + c["date"]
-            fields[field] = True
-            data[c["countryiso3code"]][field] = c['value']
-fields = fields.keys()
+    if debug:
+        print(data)
 
-if DEBUG:
-    print(data)
+    with open(DEBUG_OUTPUT_CSV if debug else OUTPUT_CSV, 'w+', newline='') as f:
+        w = csv.DictWriter(f, fields, extrasaction = "ignore")
+        w.writeheader()
+        for k in data: w.writerow(data[k])
+    return data
 
-w = csv.DictWriter(open(OUTPUT_CSV, 'w+', newline=''), fields, extrasaction = "ignore")
-w.writeheader()
-for k in data: w.writerow(data[k])
\ No newline at end of file
+# Main
+if __name__ == '__main__':
+    crawler.configure_from_args(sys.argv)
+    profiling.enable_from_args(sys.argv)
+    main()